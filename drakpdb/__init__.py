@@ -1,10 +1,30 @@
-from .drakpdb import make_pdb_profile, pe_codeview_data
+from .drakpdb import (
+    diff_pdb_layouts,
+    iter_pdb_profile,
+    make_pdb_profile,
+    pdb_layout_hashes,
+    pe_codeview_data,
+)
 from .fetch_pdb import fetch_pdb
+from .index import update_index
 from .main import main
+from .pdbparse.symtable import SymbolTable
+from .profile_cache import ProfileCache
+from .profile_writer import write_profile, write_profile_file
+from .type_info import TypeInternPool
 
 __all__ = [
     "make_pdb_profile",
+    "iter_pdb_profile",
+    "write_profile",
+    "write_profile_file",
     "pe_codeview_data",
+    "pdb_layout_hashes",
+    "diff_pdb_layouts",
     "fetch_pdb",
+    "update_index",
     "main",
+    "TypeInternPool",
+    "SymbolTable",
+    "ProfileCache",
 ]
@@ -1,3 +1,4 @@
+import functools
 import os
 import re
 from typing import Union
@@ -6,9 +7,12 @@ import pefile
 from construct.lib.containers import Container
 
 from . import pdbparse
+from .pdbparse import undname
 from .pdbparse.dbgold import CV_RSDS_HEADER
 from .pdbparse.symlookup import DummyOmap
-from .type_info import process_tpi
+from .pdbparse.symtable import SymbolTable
+from .profile_cache import DEFAULT_CACHE_MAX_SIZE, ProfileCache
+from .type_info import diff_layout_hashes, iter_tpi, layout_hashes, select_structures
 
 
 class Demangler(object):
@@ -63,9 +67,6 @@ class Demangler(object):
         )
         return result
 
-    SIMPLE_X86_CALL = re.compile(r"[_@]([A-Za-z0-9_]+)@(\d{1,3})$")
-    FUNCTION_NAME_RE = re.compile(r"\?([A-Za-z0-9_]+)@")
-
     def DemangleName(self, mangled_name):
         """Returns the de-mangled name.
 
@@ -73,29 +74,74 @@ class Demangler(object):
         care about the prototype, nor c++ exports. In the future we should
         though.
         """
-        m = self.SIMPLE_X86_CALL.match(mangled_name)
-        if m:
-            # If we see x86 name mangling (_cdecl, __stdcall) with stack sizes
-            # of 4 bytes, this is definitely a 32 bit pdb. Sometimes we dont
-            # know the architecture of the pdb file for example if we do not
-            # have the original binary, but only the GUID as extracted by
-            # version_scan.
-            # TODO set arch to i386
-            return m.group(1)
-
-        m = self.FUNCTION_NAME_RE.match(mangled_name)
-        if m:
-            return m.group(1)
-
-        # Strip the first _ from the name. I386 mangled constants have a
-        # leading _ but their AMD64 counterparts do not.
-        if mangled_name and mangled_name[0] in "_.":
-            mangled_name = mangled_name[1:]
-
-        elif mangled_name.startswith("??_C@"):
-            return self._UnpackMangledString(mangled_name)
-
+        return demangle_name(mangled_name)
+
+
+# All the cases handled by Demangler.DemangleName, tried in this order:
+DEMANGLE_RE = re.compile(
+    # If we see x86 name mangling (_cdecl, __stdcall) with stack sizes
+    # of 4 bytes, this is definitely a 32 bit pdb. Sometimes we dont
+    # know the architecture of the pdb file for example if we do not
+    # have the original binary, but only the GUID as extracted by
+    # version_scan.
+    # TODO set arch to i386
+    r"[_@](?P<x86_call>[A-Za-z0-9_]+)@\d{1,3}$"
+    # C++ function name
+    r"|\?(?P<function>[A-Za-z0-9_]+)@"
+    # Strip the first _ from the name. I386 mangled constants have a
+    # leading _ but their AMD64 counterparts do not.
+    r"|(?P<strip>[_.])"
+    r"|(?P<string>\?\?_C@)"
+)
+
+# Number of demangled names remembered by demangle_name
+DEMANGLE_CACHE_SIZE = 64 * 1024
+
+_demangler = Demangler()
+
+
+@functools.lru_cache(maxsize=DEMANGLE_CACHE_SIZE)
+def demangle_name(mangled_name):
+    """
+    Returns the de-mangled name, like Demangler.DemangleName. Results are
+    cached, as many names repeat in symbols of a PDB.
+    """
+    m = DEMANGLE_RE.match(mangled_name)
+    if m is None:
         return mangled_name
+    kind = m.lastgroup
+    if kind == "strip":
+        return mangled_name[1:]
+    if kind == "string":
+        return _demangler._UnpackMangledString(mangled_name)
+    return m.group(kind)
+
+
+def demangle_names(mangled_names, full=False):
+    """
+    Returns the list of de-mangled `mangled_names`. With `full`, C++ names
+    are demangled with undname into qualified names (e.g.
+    "std::exception::exception"), all at once. Other names, and C++ names
+    undname can't handle, are de-mangled with demangle_name.
+    """
+    if not full:
+        return [demangle_name(name) for name in mangled_names]
+    cpp_names = list(
+        {
+            name: None
+            for name in mangled_names
+            if name.startswith("?") and not name.startswith("??_C@")
+        }
+    )
+    demangled = {
+        name: undecorated
+        for name, undecorated in zip(
+            cpp_names, undname.undname_many(cpp_names, undname.UNDNAME_NAME_ONLY)
+        )
+        # undname returns names it can't handle as they are
+        if undecorated and undecorated != name
+    }
+    return [demangled.get(name) or demangle_name(name) for name in mangled_names]
 
 
 def make_symstore_hash(
@@ -116,9 +162,128 @@ def make_symstore_hash(
 
 
 def make_pdb_profile(
-    filepath, dll_origin_path=None, dll_path=None, dll_symstore_hash=None
+    filepath,
+    dll_origin_path=None,
+    dll_path=None,
+    dll_symstore_hash=None,
+    data=None,
+    structs=None,
+    intern_pool=None,
+    with_layout_hashes=False,
+    full_demangle=False,
+    cache_dir=None,
+    cache_max_size=DEFAULT_CACHE_MAX_SIZE,
+):
+    """
+    Generates profile from PDB file under `filepath`. If `data` with the PDB
+    contents is given, the file is not opened and `filepath` is only used
+    as the PDB name recorded in profile metadata.
+
+    `structs` limits "$STRUCTS" to the listed structures and structures
+    they refer to through members, pointers and bitfields.
+
+    When generating many profiles, pass the same `TypeInternPool` as
+    `intern_pool` to all calls: structures with the same layout are then
+    converted once and shared between the profiles.
+
+    With `with_layout_hashes`, "$LAYOUT_HASHES" maps each structure name to
+    a hash of its layout (see `pdb_layout_hashes`).
+
+    With `full_demangle`, names of C++ functions and constants are fully
+    qualified (e.g. "std::exception::exception" instead of "exception"),
+    see `demangle_names`.
+
+    With `cache_dir`, profiles are cached in that directory (see
+    `ProfileCache`). A cached profile is returned after reading just the
+    PDB header, as long as it was generated by the same drakpdb version
+    with the same options.
+    """
+    if cache_dir is not None:
+        cache = ProfileCache(cache_dir, cache_max_size)
+        if data is not None:
+            pdb_probe = pdbparse.probe_bytes(data)
+        else:
+            pdb_probe = pdbparse.probe(filepath)
+        cache_key = cache.key(
+            make_symstore_hash(pdb_probe),
+            pdb_file=os.path.basename(filepath),
+            dll_origin_path=str(dll_origin_path) if dll_origin_path else None,
+            dll_path=str(dll_path) if dll_path else None,
+            dll_symstore_hash=dll_symstore_hash,
+            structs=sorted(set(structs)) if structs is not None else None,
+            with_layout_hashes=with_layout_hashes,
+            full_demangle=full_demangle,
+        )
+        profile = cache.get(cache_key)
+        if profile is not None:
+            return profile
+
+    profile = {
+        section: entries if isinstance(entries, dict) else dict(entries)
+        for section, entries in iter_pdb_profile(
+            filepath,
+            dll_origin_path,
+            dll_path,
+            dll_symstore_hash,
+            data,
+            structs,
+            intern_pool,
+            with_layout_hashes,
+            full_demangle,
+        )
+    }
+    if cache_dir is not None:
+        cache.put(cache_key, profile)
+    return profile
+
+
+def public_symbols(pdb):
+    """
+    Returns public symbols of `pdb`. If the PDB has an address map of
+    public symbols, they're sorted by section and offset.
+    """
+    try:
+        return pdb.STREAM_PSGSI.publics()
+    except (AttributeError, ValueError):
+        # No public symbol stream, or a broken one
+        return pdb.STREAM_GSYM.globals
+
+
+def _numbered_symbols(groups):
+    # Symbols with many addresses get "_1", "_2"... suffixes, in address
+    # order. A suffixed name may collide with another symbol, the last
+    # address wins then.
+    numbered = {}
+    for sym_name, addresses in groups:
+        for ndx, mapped in enumerate(addresses):
+            if ndx == 0:
+                numbered[sym_name] = mapped
+            else:
+                numbered["{}_{}".format(sym_name, ndx)] = mapped
+    return iter(numbered.items())
+
+
+def iter_pdb_profile(
+    filepath,
+    dll_origin_path=None,
+    dll_path=None,
+    dll_symstore_hash=None,
+    data=None,
+    structs=None,
+    intern_pool=None,
+    with_layout_hashes=False,
+    full_demangle=False,
 ):
-    pdb = pdbparse.parse(filepath)
+    """
+    Generates profile like `make_pdb_profile`, section by section. Yields
+    (section name, entries) pairs in profile order. Entries of "$FUNCTIONS",
+    "$CONSTANTS" and "$STRUCTS" are iterators of (name, value) pairs that
+    are produced on demand, other sections are dicts.
+    """
+    if data is not None:
+        pdb = pdbparse.parse_bytes(data)
+    else:
+        pdb = pdbparse.parse(filepath)
 
     try:
         sects = pdb.STREAM_SECT_HDR_ORIG.sections
@@ -129,53 +294,20 @@ def make_pdb_profile(
         sects = pdb.STREAM_SECT_HDR.sections
         omap = DummyOmap()
 
-    gsyms = pdb.STREAM_GSYM
-    tpi = process_tpi(pdb)
-    profile = {"$FUNCTIONS": {}, "$CONSTANTS": {}, **tpi}
-    mapped_syms = {"$CONSTANTS": {}, "$FUNCTIONS": {}}
-
-    for sym in gsyms.globals:
-        try:
-            off = sym.offset
-            sym_name = sym.name
-            virt_base = sects[sym.segment - 1].VirtualAddress
-            mapped = omap.remap(off + virt_base)
-            if (sym.symtype & 2) == 2:
-                target_key = "$FUNCTIONS"
-            else:
-                target_key = "$CONSTANTS"
-        except IndexError:
-            # skip symbol because segment was not found
-            continue
-        except AttributeError:
-            # missing offset in symbol?
-            continue
+    symbols = SymbolTable(public_symbols(pdb))
+    symbols.map(sects, omap)
+    # Names are de-mangled all at once, see demangle_names
+    sym_names = demangle_names(symbols.names, full_demangle)
 
-        sym_name = Demangler().DemangleName(sym_name)
+    yield "$FUNCTIONS", _numbered_symbols(symbols.groups(sym_names, 2, 2))
+    yield "$CONSTANTS", _numbered_symbols(symbols.groups(sym_names, 2, 0))
+    del symbols, sym_names
+    yield from iter_tpi(pdb, structs, intern_pool, with_layout_hashes)
 
-        if sym_name not in mapped_syms[target_key]:
-            mapped_syms[target_key][sym_name] = list()
-
-        mapped_syms[target_key][sym_name].append(mapped)
-
-    for target_key, sym_dict in mapped_syms.items():
-        for sym_name, value_set in sym_dict.items():
-            ndx = 0
-
-            for mapped in sorted(value_set):
-                if ndx == 0:
-                    next_sym_name = sym_name
-                else:
-                    next_sym_name = "{}_{}".format(sym_name, ndx)
-
-                ndx += 1
-                profile[target_key][next_sym_name] = mapped
-
-    del mapped_syms
     pdb_symstore_hash = make_symstore_hash(pdb.STREAM_PDB)
     base_filename = os.path.splitext(os.path.basename(filepath))[0]
 
-    profile["$METADATA"] = {
+    yield "$METADATA", {
         "DLL_GUID_AGE": dll_symstore_hash,
         "GUID_AGE": pdb_symstore_hash,
         "PDBFile": os.path.basename(filepath),
@@ -188,20 +320,55 @@ def make_pdb_profile(
     }
 
     # Additional metadata requested by the ApiVectors developers
-    profile["$EXTRAS"] = {}
+    extras = {}
     if dll_origin_path:
-        profile["$EXTRAS"]["DLLPath"] = str(dll_origin_path)
+        extras["DLLPath"] = str(dll_origin_path)
 
     if dll_path:
         try:
             pe = pefile.PE(dll_path, fast_load=True)
-            profile["$EXTRAS"]["ImageBase"] = hex(pe.OPTIONAL_HEADER.ImageBase)
+            extras["ImageBase"] = hex(pe.OPTIONAL_HEADER.ImageBase)
         except AttributeError:
             # I think that DLLs have some sanity and the optional header is
             # always present. Ignore this error if it happens
             pass
+    yield "$EXTRAS", extras
 
-    return profile
+
+def pdb_layout_hashes(filepath, data=None, structs=None):
+    """
+    Returns structure name -> layout hash for PDB file under `filepath` (or
+    `data`, as in `make_pdb_profile`). The hash covers the size of a
+    structure and names, offsets and types of its members, including
+    layouts of structures embedded in it. Symbols are not read at all.
+    """
+    if data is not None:
+        pdb = pdbparse.parse_bytes(data)
+    else:
+        pdb = pdbparse.parse(filepath)
+
+    if structs is not None:
+        types = select_structures(pdb.STREAM_TPI, structs)
+    else:
+        types = {
+            type_info.name: type_info
+            for type_info in pdb.STREAM_TPI.types.values()
+            if hasattr(type_info, "name")
+        }
+    return layout_hashes(types)
+
+
+def diff_pdb_layouts(old, new):
+    """
+    Compares structure layouts of two PDB files (or name -> layout hash
+    mappings). Returns names of structures that were added, removed and
+    changed.
+    """
+    if not isinstance(old, dict):
+        old = pdb_layout_hashes(old)
+    if not isinstance(new, dict):
+        new = pdb_layout_hashes(new)
+    return diff_layout_hashes(old, new)
 
 
 def pe_codeview_data(filepath):
@@ -0,0 +1,89 @@
+import json
+import os
+
+from . import pdbparse
+from .drakpdb import make_symstore_hash
+from .profile_writer import atomic_file
+
+INDEX_FILENAME = "drakpdb_index.json"
+INDEX_VERSION = 1
+
+
+def _iter_pdb_files(directory):
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if filename.lower().endswith(".pdb"):
+                yield os.path.join(root, filename)
+
+
+def _probe_entry(path, stat):
+    entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+    try:
+        pdb_probe = pdbparse.probe(path)
+    except Exception as e:
+        # Remember broken files too, so they're not probed on every update
+        entry["error"] = str(e) or type(e).__name__
+        return entry
+    entry.update(
+        {
+            "GUID_AGE": make_symstore_hash(pdb_probe),
+            "Timestamp": pdb_probe.TimeDateStamp.strftime("%Y-%m-%d %H:%M:%SZ"),
+            "Machine": pdb_probe.Machine,
+        }
+    )
+    return entry
+
+
+def load_index(index_path):
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    return index
+
+
+def update_index(directory, index_path=None):
+    """
+    Builds GUID_AGE -> path inventory of PDB files found under `directory`.
+
+    The inventory is stored in `index_path` (by default `drakpdb_index.json`
+    in the indexed directory) and reused on next update: only PDB files with
+    a changed mtime or size are probed again. Paths are relative to
+    `directory`.
+
+    Returns the inventory and the number of probed files.
+    """
+    if index_path is None:
+        index_path = os.path.join(directory, INDEX_FILENAME)
+
+    previous = load_index(index_path)
+    previous_files = previous["files"] if previous else {}
+
+    files = {}
+    probed = 0
+    for path in _iter_pdb_files(directory):
+        relpath = os.path.relpath(path, directory)
+        stat = os.stat(path)
+        entry = previous_files.get(relpath)
+        if (
+            entry is None
+            or entry["mtime"] != stat.st_mtime_ns
+            or entry["size"] != stat.st_size
+        ):
+            entry = _probe_entry(path, stat)
+            probed += 1
+        files[relpath] = entry
+
+    pdbs = {}
+    for relpath in sorted(files):
+        guid_age = files[relpath].get("GUID_AGE")
+        if guid_age is not None:
+            pdbs.setdefault(guid_age, relpath)
+
+    index = {"version": INDEX_VERSION, "pdbs": pdbs, "files": files}
+    with atomic_file(index_path, "w") as f:
+        json.dump(index, f, indent=4)
+    return index, probed
@@ -1,8 +1,37 @@
 import argparse
 import json
+import sys
+import time
 
-from .drakpdb import make_pdb_profile, pe_codeview_data
+from .drakpdb import (
+    diff_pdb_layouts,
+    iter_pdb_profile,
+    make_pdb_profile,
+    pe_codeview_data,
+)
 from .fetch_pdb import fetch_pdb
+from .index import update_index
+from .profile_cache import DEFAULT_CACHE_MAX_SIZE
+from .profile_writer import (
+    ENCODER_BACKENDS,
+    default_backend,
+    write_profile,
+    write_profile_file,
+)
+
+
+def _load_layout_hashes(parser, path):
+    """
+    Returns layout hashes from a profile generated with --layout-hashes,
+    or the path itself if it's not a profile (assumed to be a PDB file)
+    """
+    if not path.lower().endswith(".json"):
+        return path
+    with open(path, "r") as f:
+        profile = json.load(f)
+    if "$LAYOUT_HASHES" not in profile:
+        parser.error("{} has no layout hashes, use --layout-hashes".format(path))
+    return profile["$LAYOUT_HASHES"]
 
 
 def main():
@@ -11,6 +40,69 @@ def main():
     pdbname_subparser = argparse.ArgumentParser(add_help=False)
     pdbname_subparser.add_argument("pdb_name", type=str, help="name of the pdb file")
 
+    pdbname_stdin_subparser = argparse.ArgumentParser(add_help=False)
+    pdbname_stdin_subparser.add_argument(
+        "pdb_name", type=str, help="name of the pdb file or '-' to read it from stdin"
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--name",
+        type=str,
+        help="name of the pdb file to put in profile metadata when reading from stdin",
+    )
+
+    pdbname_stdin_subparser.add_argument(
+        "--structs",
+        type=lambda structs: structs.split(","),
+        help="comma-separated list of structures to put in profile "
+        "(along with structures they refer to), all by default",
+    )
+
+    pdbname_stdin_subparser.add_argument(
+        "--layout-hashes",
+        action="store_true",
+        help="add layout hashes of structures to profile",
+    )
+
+    pdbname_stdin_subparser.add_argument(
+        "--full-demangle",
+        action="store_true",
+        help="use fully qualified names of C++ functions and constants",
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--output",
+        type=str,
+        help="file to write profile to, instead of stdout",
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--compact",
+        action="store_true",
+        help="write profile without indentation and whitespace",
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--encoder",
+        choices=sorted(ENCODER_BACKENDS),
+        help="JSON encoder to use (default: orjson for compact profiles "
+        "if installed, json otherwise)",
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="directory to cache generated profiles in, profiles of the same "
+        "PDB generated with the same options are then reused",
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=DEFAULT_CACHE_MAX_SIZE // (1024 * 1024),
+        help="maximum total size of cached profiles in MiB, least recently "
+        "used ones are removed above it (default: %(default)s)",
+    )
+    pdbname_stdin_subparser.add_argument(
+        "--report",
+        action="store_true",
+        help="print profile size and generation time to stderr",
+    )
+
     dllname_subparser = argparse.ArgumentParser(add_help=False)
     dllname_subparser.add_argument("dll_name", type=str, help="path to the dll file")
 
@@ -21,9 +113,9 @@ def main():
 
     action = parser.add_subparsers(help="Action commands", dest="action")
     action.required = True
-    action.add_parser(
+    parse_pdb_parser = action.add_parser(
         "parse_pdb",
-        parents=[pdbname_subparser],
+        parents=[pdbname_stdin_subparser],
         help="Parse PDB file into Rekall profile",
     )
     action.add_parser(
@@ -36,14 +128,84 @@ def main():
         parents=[dllname_subparser],
         help="Get PDB name and GUID/Age for DLL path",
     )
+    index_parser = action.add_parser(
+        "index",
+        help="Build GUID/Age inventory of PDB files stored in directory",
+    )
+    index_parser.add_argument("directory", type=str, help="directory with PDB files")
+    index_parser.add_argument(
+        "--index-file",
+        type=str,
+        help="path of the inventory file (default: drakpdb_index.json in directory)",
+    )
+    diff_parser = action.add_parser(
+        "diff",
+        help="List structures whose layout differs between two PDB files",
+    )
+    diff_parser.add_argument(
+        "old", type=str, help="old pdb file or profile with layout hashes"
+    )
+    diff_parser.add_argument(
+        "new", type=str, help="new pdb file or profile with layout hashes"
+    )
     args = parser.parse_args()
 
     if args.action == "parse_pdb":
-        profile = make_pdb_profile(args.pdb_name)
-        print(json.dumps(profile, indent=4))
+        indent = None if args.compact else 4
+        if args.encoder == "orjson" and not args.compact:
+            parse_pdb_parser.error("orjson encoder requires --compact")
+        backend = args.encoder or default_backend(indent)
+        if args.pdb_name == "-":
+            if not args.name:
+                parse_pdb_parser.error("--name is required when reading from stdin")
+            pdb_name, data = args.name, sys.stdin.buffer.read()
+        else:
+            pdb_name, data = args.pdb_name, None
+        options = {
+            "data": data,
+            "structs": args.structs,
+            "with_layout_hashes": args.layout_hashes,
+            "full_demangle": args.full_demangle,
+        }
+        start = time.perf_counter()
+        if args.cache_dir:
+            profile = make_pdb_profile(
+                pdb_name,
+                cache_dir=args.cache_dir,
+                cache_max_size=args.cache_max_size * 1024 * 1024,
+                **options,
+            ).items()
+        else:
+            profile = iter_pdb_profile(pdb_name, **options)
+        if args.output:
+            size = write_profile_file(profile, args.output, indent, backend)
+        else:
+            size = write_profile(profile, sys.stdout.buffer, indent, backend)
+            sys.stdout.buffer.write(b"\n")
+        if args.report:
+            print(
+                "Profile: {} bytes in {:.2f}s ({} encoder)".format(
+                    size, time.perf_counter() - start, backend
+                ),
+                file=sys.stderr,
+            )
     elif args.action == "fetch_pdb":
         fetch_pdb(args.pdb_name, args.guid_age)
     elif args.action == "pe_codeview_data":
         print(pe_codeview_data(args.dll_name))
+    elif args.action == "index":
+        index, probed = update_index(args.directory, args.index_file)
+        print("Indexed {} PDB files ({} probed)".format(len(index["files"]), probed))
+    elif args.action == "diff":
+        changes = diff_pdb_layouts(
+            _load_layout_hashes(diff_parser, args.old),
+            _load_layout_hashes(diff_parser, args.new),
+        )
+        for name in changes["changed"]:
+            print("changed " + name)
+        for name in changes["added"]:
+            print("added " + name)
+        for name in changes["removed"]:
+            print("removed " + name)
     else:
         raise RuntimeError("Unknown action")
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 from __future__ import absolute_import
 
+from .msf import MSFFile, PageCache
 from .pdbparse import (
     PDB_STREAM_ROOT,
     PDB_STREAM_PDB,
@@ -24,6 +25,10 @@ from .pdbparse import (
     PDB7,
     PDB2,
     parse,
+    parse_bytes,
+    PDBProbe,
+    probe,
+    probe_bytes,
 )
 
 __all__ = [
@@ -31,6 +36,8 @@ __all__ = [
     "PDB_STREAM_PDB",
     "PDB_STREAM_TPI",
     "PDB_STREAM_DBI",
+    "MSFFile",
+    "PageCache",
     "StreamFile",
     "PDBStream",
     "ParsedPDBStream",
@@ -49,4 +56,8 @@ __all__ = [
     "PDB7",
     "PDB2",
     "parse",
+    "parse_bytes",
+    "PDBProbe",
+    "probe",
+    "probe_bytes",
 ]
@@ -24,16 +24,15 @@ static PyObject* undname_py(PyObject* self,PyObject* args)
     char *out;
 
     if (!PyArg_ParseTuple(args, "s*H:undname", &mangled, &flags))
-        return Py_None;
-        
+        return NULL;
+
     // passing NULL as buffer : dynamic allocation used
     out = undname(NULL, (char*) mangled.buf, (int) mangled.len, flags);
+    PyBuffer_Release(&mangled);
     if (!out)
-        return Py_None;
-
+        Py_RETURN_NONE;
 
     return_value = Py_BuildValue("s",out);
-    Py_INCREF(return_value);
 
     // Discaring temporary unmangled bufferhelp
     free(out);
@@ -41,8 +40,92 @@ static PyObject* undname_py(PyObject* self,PyObject* args)
     return return_value;
 }
 
+static const char undname_many_doc[] = ""                                   \
+"undname_many(mangled: list of str or bytes, flags : int) -> list of str\n\n" \
+"Undecorate a list of mangled C++ names with the same flags, without\n"     \
+"holding the GIL. Return the list of unmangled names, with None for the\n"  \
+"ones that can not be undecorated.";
+
+static PyObject* undname_many_py(PyObject* self,PyObject* args)
+{
+    PyObject *names;
+    PyObject *items;
+    PyObject *return_value = NULL;
+    unsigned short int flags = 0;
+    const char **mangled = NULL;
+    char **out = NULL;
+    Py_ssize_t count, i;
+
+    if (!PyArg_ParseTuple(args, "OH:undname_many", &names, &flags))
+        return NULL;
+
+    // A tuple keeps the names alive (and their buffers valid) while the GIL
+    // is released, even if the list they come from is modified meanwhile
+    items = PySequence_Tuple(names);
+    if (!items)
+        return NULL;
+    count = PyTuple_GET_SIZE(items);
+
+    mangled = PyMem_Calloc(count ? count : 1, sizeof(*mangled));
+    out = PyMem_Calloc(count ? count : 1, sizeof(*out));
+    if (!mangled || !out) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    for (i = 0; i < count; i++) {
+        PyObject *name = PyTuple_GET_ITEM(items, i);
+        if (PyUnicode_Check(name)) {
+            mangled[i] = PyUnicode_AsUTF8(name);
+        } else if (PyBytes_Check(name)) {
+            mangled[i] = PyBytes_AS_STRING(name);
+        } else {
+            PyErr_Format(PyExc_TypeError,
+                         "undname_many() names must be str or bytes, not %.200s",
+                         Py_TYPE(name)->tp_name);
+            goto done;
+        }
+        if (!mangled[i])
+            goto done;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < count; i++)
+        out[i] = undname(NULL, (char*) mangled[i], 0, flags);
+    Py_END_ALLOW_THREADS
+
+    return_value = PyList_New(count);
+    if (!return_value)
+        goto done;
+    for (i = 0; i < count; i++) {
+        PyObject *value;
+        if (out[i]) {
+            value = PyUnicode_FromString(out[i]);
+            if (!value) {
+                Py_CLEAR(return_value);
+                goto done;
+            }
+        } else {
+            value = Py_None;
+            Py_INCREF(value);
+        }
+        PyList_SET_ITEM(return_value, i, value);
+    }
+
+done:
+    if (out) {
+        for (i = 0; i < count; i++)
+            free(out[i]);
+        PyMem_Free(out);
+    }
+    PyMem_Free(mangled);
+    Py_DECREF(items);
+    return return_value;
+}
+
 static PyMethodDef undname_methods[] = {
     {"undname", undname_py, METH_VARARGS, undname_doc},
+    {"undname_many", undname_many_py, METH_VARARGS, undname_many_doc},
     {NULL, NULL, 0, NULL}
 };
 
@@ -54,7 +137,7 @@ static struct PyModuleDef cUndnameModule =
 {
     PyModuleDef_HEAD_INIT,
     "_undname",   /* name of module */
-    "_undname module. Provide undname() function for symbol undecoration",       /* module documentation, may be NULL */
+    "_undname module. Provide undname() and undname_many() functions for symbol undecoration",       /* module documentation, may be NULL */
     -1,          /* size of per-interpreter state of the module, or -1 if the module keeps state in global variables. */
     undname_methods
 };
@@ -1,5 +1,8 @@
 # Python 2 and 3
 
+import struct
+from collections import namedtuple
+
 from construct import *
 
 gsym = Struct(
@@ -52,3 +55,115 @@ def merge_structures(con):
         new_cons.append(Container(sym_dict))
     result = ListContainer(new_cons)
     return result
+
+
+### Fast decoder
+#
+# Decoding the whole stream with the constructs above is slow and keeps a
+# Container for every record, even for the ones that are thrown away. The
+# kinds of records drakpdb uses are decoded with struct directly from the
+# stream buffer instead, into compact tuples, and other records are
+# skipped by their length.
+
+S_PUB32_ST = 0x1009
+S_LDATA32 = 0x110C
+S_GDATA32 = 0x110D
+S_PUB32 = 0x110E
+S_PROCREF = 0x1125
+S_LPROCREF = 0x1127
+
+# symtype holds the public symbol flags (2 is for functions)
+PublicSymbol = namedtuple("PublicSymbol", "length leaf_type symtype offset segment name")
+# Global (S_GDATA32) or module-local (S_LDATA32) variable
+DataSymbol = namedtuple("DataSymbol", "length leaf_type type_index offset segment name")
+# Reference to a procedure in the symbols of module number `module` (1-based)
+ProcRefSymbol = namedtuple("ProcRefSymbol", "length leaf_type sum_name sym_offset module name")
+
+_record_header = struct.Struct("<HH")
+_record_length = struct.Struct("<H")
+_record_body = struct.Struct("<IIH")
+
+_symbol_types = {
+    S_PUB32: PublicSymbol,
+    S_PUB32_ST: PublicSymbol,
+    S_LDATA32: DataSymbol,
+    S_GDATA32: DataSymbol,
+    S_PROCREF: ProcRefSymbol,
+    S_LPROCREF: ProcRefSymbol,
+}
+
+
+def _decode_record(data, pos, end):
+    """Decode the record at pos: returns (symbol or None if it's not decoded,
+    position of the next record), or (None, -1) if the record is truncated"""
+    length, leaf_type = _record_header.unpack_from(data, pos)
+    record_end = pos + 2 + length
+    if length < 2 or record_end > end:
+        return None, -1
+    symbol_type = _symbol_types.get(leaf_type)
+    body = pos + 4
+    if symbol_type is None or body + 10 > record_end:
+        return None, record_end
+    value, offset, segment = _record_body.unpack_from(data, body)
+    body += 10
+    if leaf_type == S_PUB32_ST:
+        # Name with a length prefix
+        if body >= record_end:
+            return None, record_end
+        name_end = body + 1 + data[body]
+        body += 1
+    else:
+        name_end = data.find(b"\0", body, record_end)
+    if name_end < 0 or name_end > record_end:
+        return None, record_end
+    try:
+        name = data[body:name_end].decode("utf8")
+    except UnicodeDecodeError:
+        return None, record_end
+    return symbol_type(length, leaf_type, value, offset, segment, name), record_end
+
+
+def decode_symbols(data):
+    """Yields the public, data and procedure reference symbols of a global
+    symbol stream, other records are skipped.
+
+    data: bytes-like contents of the stream
+    """
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    end = len(data)
+    pos = 0
+    while pos + 4 <= end:
+        symbol, pos = _decode_record(data, pos, end)
+        if pos < 0:
+            # Truncated record, nothing more to decode
+            break
+        if symbol is not None:
+            yield symbol
+
+
+def decode_symbols_at(data, offsets):
+    """Yields the symbols of a global symbol stream stored at given offsets
+    (e.g. from the address map of the public symbol stream), skipping
+    records that are not decoded. Only these records are copied out of
+    data that is not bytes.
+
+    data: bytes-like contents of the stream
+    """
+    end = len(data)
+    for pos in offsets:
+        if pos + 4 > end:
+            continue
+        if isinstance(data, bytes):
+            symbol, _ = _decode_record(data, pos, end)
+        else:
+            (length,) = _record_length.unpack_from(data, pos)
+            record = bytes(data[pos:pos + 2 + length])
+            symbol, _ = _decode_record(record, 0, len(record))
+        if symbol is not None:
+            yield symbol
+
+
+def decode_publics(data):
+    """Returns the list of public symbols (S_PUB32) of a global symbol stream"""
+    return [sym for sym in decode_symbols(data) if type(sym) is PublicSymbol]
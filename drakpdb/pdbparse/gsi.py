@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""Global (GSI) and public (PSGSI) symbol streams of a PDB.
+
+Both index records of the global symbol stream. The GSI stream is a hash
+table of global symbols by name. The PSGSI stream starts with a header,
+followed by a hash table of public symbols (of SymHash bytes) and the
+address map (of AddrMap bytes): offsets of S_PUB32 records in the global
+symbol stream, sorted by the section:offset address of the symbols.
+Thunk and section maps follow.
+
+A hash table starts with a header, followed by hash records, a bitmap of
+non-empty buckets and the offsets of the first hash record of each
+non-empty bucket.
+"""
+import sys
+from array import array
+
+from construct import *
+
+from .hashing import hash_string_v1
+
+GSI_HASH_SIGNATURE = 0xFFFFFFFF
+GSI_HASH_VERSION = 0xEFFE0000 + 19990810
+# Number of hash buckets
+GSI_HASH_BUCKETS = 4096
+# Size of the in-memory hash record that bucket offsets are given in
+GSI_HASH_RECORD_SIZE = 12
+
+GSIHashHeader = "GSIHashHeader" / Struct(
+    "VerSignature" / Int32ul,
+    "VerHdr" / Int32ul,
+    "HrSize" / Int32ul,
+    "NumBuckets" / Int32ul,
+)
+
+PSGSIHeader = "PSGSIHeader" / Struct(
+    "SymHash" / Int32ul,
+    "AddrMap" / Int32ul,
+    "NumThunks" / Int32ul,
+    "SizeOfThunk" / Int32ul,
+    "ISectThunkTable" / Int16ul,
+    Padding(2),
+    "OffThunkTable" / Int32ul,
+    "NumSections" / Int32ul,
+)
+
+
+def _u32_array(data):
+    values = array("I")
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def parse_address_map(data):
+    """Returns (header, address map) of a public symbol stream.
+
+    data: bytes-like contents of the stream
+    """
+    if len(data) < PSGSIHeader.sizeof():
+        raise ValueError("Public symbol stream is truncated")
+    header = PSGSIHeader.parse(data)
+    start = PSGSIHeader.sizeof() + header.SymHash
+    size = header.AddrMap - header.AddrMap % 4
+    if start + size > len(data):
+        raise ValueError("Address map of the public symbol stream is truncated")
+    return header, _u32_array(bytes(data[start:start + size]))
+
+
+class GSIHashTable(object):
+    """Hash table of symbols by name.
+
+    data: bytes-like hash table, starting with its header
+    """
+
+    def __init__(self, data):
+        if len(data) < GSIHashHeader.sizeof():
+            raise ValueError("Symbol hash table is truncated")
+        self.header = GSIHashHeader.parse(data)
+        if self.header.VerSignature != GSI_HASH_SIGNATURE or self.header.VerHdr != GSI_HASH_VERSION:
+            raise ValueError("Unsupported symbol hash table version")
+        start = GSIHashHeader.sizeof()
+        records_end = start + self.header.HrSize - self.header.HrSize % 8
+        buckets_end = start + self.header.HrSize + self.header.NumBuckets
+        if buckets_end > len(data):
+            raise ValueError("Symbol hash table is truncated")
+        # (Off, CRef) pairs, Off is the symbol record offset + 1
+        records = _u32_array(bytes(data[start:records_end]))
+        self.offsets = records[::2]
+
+        bitmap_words = (GSI_HASH_BUCKETS + 32) // 32
+        bitmap_end = start + self.header.HrSize + bitmap_words * 4
+        bitmap = _u32_array(bytes(data[start + self.header.HrSize:bitmap_end]))
+        starts = _u32_array(bytes(data[bitmap_end:buckets_end]))
+        count = len(self.offsets)
+
+        # bucket -> (first record, end of records)
+        self.buckets = {}
+        nonempty = [
+            word * 32 + bit
+            for word, bits in enumerate(bitmap) if bits
+            for bit in range(32) if bits & (1 << bit)
+        ]
+        for i, bucket in enumerate(nonempty[:len(starts)]):
+            first = starts[i] // GSI_HASH_RECORD_SIZE
+            end = starts[i + 1] // GSI_HASH_RECORD_SIZE if i + 1 < len(starts) else count
+            self.buckets[bucket] = (first, min(end, count))
+
+    def lookup(self, name):
+        """Returns offsets of the symbol records that may be named `name`
+        (the records in its hash bucket)"""
+        bucket = self.buckets.get(hash_string_v1(name) % GSI_HASH_BUCKETS)
+        if bucket is None:
+            return []
+        first, end = bucket
+        return [offset - 1 for offset in self.offsets[first:end]]
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""Hash functions used by the hash tables of PDB streams."""
+import struct
+
+
+def hash_string_v1(name):
+    """Hash a name the way the TPI and GSI hash tables do (hashStringV1,
+    "LHashPbCb" in the reference implementation).
+
+    name: a str (encoded as utf8) or bytes
+    """
+    if isinstance(name, str):
+        name = name.encode("utf8")
+    size = len(name)
+    longs = size // 4
+    result = 0
+    for value in struct.unpack_from("<%dI" % longs, name):
+        result ^= value
+    pos = longs * 4
+    if size - pos >= 2:
+        result ^= name[pos] | (name[pos + 1] << 8)
+        pos += 2
+    if size - pos == 1:
+        result ^= name[pos]
+    result |= 0x20202020
+    result ^= result >> 11
+    return (result ^ (result >> 16)) & 0xFFFFFFFF
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""Page-addressed access to the raw bytes of an MSF (PDB) container.
+
+Every stream of a PDB is a list of page numbers. Instead of seeking to
+each page and concatenating what was read, the whole file is mapped into
+memory once and pages are handed out as slices of that mapping:
+
+* a stream (or a part of it) whose pages follow each other on disk is
+  returned as a memoryview into the mapping, without copying anything,
+* a fragmented stream is gathered into a single bytes object, copying
+  each run of consecutive pages once.
+
+The same interface works over a bytes-like object already held in
+memory. When the file is not mapped pages are read with positional reads
+(os.pread) instead and kept in a PageCache, so pages shared by consecutive
+reads are read only once.
+
+Reads never depend on a shared file position, so streams of one PDB can
+be read from many threads at once.
+"""
+import io
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# Default memory budget of the page cache used for unmapped files
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+
+def _page_runs(pages):
+    """Group a list of page numbers into (first_page, count) runs of
+    consecutive pages."""
+    runs = []
+    it = iter(pages)
+    try:
+        start = prev = next(it)
+    except StopIteration:
+        return runs
+    for pn in it:
+        if pn != prev + 1:
+            runs.append((start, prev - start + 1))
+            start = pn
+        prev = pn
+    runs.append((start, prev - start + 1))
+    return runs
+
+
+class PageCache:
+    """Least recently used cache of file pages.
+
+    max_size: memory budget, in bytes, for the data of cached pages
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pn):
+        with self._lock:
+            data = self._pages.get(pn)
+            if data is not None:
+                self._pages.move_to_end(pn)
+            return data
+
+    def put(self, pn, data):
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            old = self._pages.pop(pn, None)
+            if old is not None:
+                self.size -= len(old)
+            self._pages[pn] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+
+class MSFFile:
+    """Raw page reader shared by all streams of a single PDB file.
+
+    fp: file object holding the PDB, or a bytes-like object with its contents
+    page_size: the size of a page, in bytes. Usually only known after the
+        superblock is parsed, so it can be updated later on.
+    use_mmap: map the file into memory if possible
+    cache_size: memory budget of the page cache used when the file is not
+        mapped, 0 disables caching
+    """
+
+    def __init__(self, fp, page_size=0x1000, use_mmap=True, cache_size=DEFAULT_CACHE_SIZE):
+        self.fp = fp
+        self.page_size = page_size
+        self._mmap = None
+        self.buf = None
+        self.cache = PageCache(cache_size) if cache_size else None
+        self._fd = None
+        self._lock = threading.Lock()
+        try:
+            # Already in memory, slices of it are as good as a mapping
+            self.buf = memoryview(fp).cast("B")
+            self.fp = None
+            return
+        except TypeError:
+            pass
+        if use_mmap:
+            try:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                # Not backed by a file descriptor, or an empty file
+                self._mmap = None
+            else:
+                self.buf = memoryview(self._mmap)
+                return
+        if hasattr(os, "pread"):
+            try:
+                self._fd = fp.fileno()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                self._fd = None
+
+    def read(self, offset, size):
+        """Read size bytes at an absolute offset of the file."""
+        if self.buf is not None:
+            return self.buf[offset:offset + size]
+        if self._fd is not None:
+            return os.pread(self._fd, size, offset)
+        # No positional reads for this file object
+        with self._lock:
+            self.fp.seek(offset)
+            return self.fp.read(size)
+
+    def read_pages(self, pages, size=-1):
+        """Read the data stored in a list of pages.
+
+        Parameters :
+            * (list) pages: a list of page numbers that make up the data requested
+            * (int) size: the number of bytes requested, -1 reads whole pages
+        Return :
+            * (bytes-like) a memoryview if the pages are contiguous and the
+              file is mapped, bytes otherwise
+        """
+        page_size = self.page_size
+        if size == -1:
+            size = len(pages) * page_size
+        runs = _page_runs(pages)
+        if len(runs) == 1:
+            start, count = runs[0]
+            data = self._read_run(start, count)
+            return data[:size] if size < len(data) else data
+
+        chunks = []
+        for start, count in runs:
+            if size <= 0:
+                break
+            data = self._read_run(start, count)
+            chunks.append(data[:size] if size < len(data) else data)
+            size -= len(data)
+        return b"".join(chunks)
+
+    def _read_run(self, start, count):
+        """Read count consecutive pages, starting from page start."""
+        page_size = self.page_size
+        if self.buf is not None or self.cache is None:
+            return self.read(start * page_size, count * page_size)
+
+        cached = [self.cache.get(pn) for pn in range(start, start + count)]
+        if None not in cached:
+            return cached[0] if count == 1 else b"".join(cached)
+
+        data = self.read(start * page_size, count * page_size)
+        for i in range(count):
+            self.cache.put(start + i, data[i * page_size:(i + 1) * page_size])
+        return data
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.release()
+            self.buf = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views of some streams are still alive, the mapping will
+                # be released together with them.
+                pass
+            self._mmap = None
+        self._fd = None
+        if self.fp is not None:
+            self.fp.close()
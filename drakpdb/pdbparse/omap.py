@@ -3,6 +3,11 @@
 from construct import *
 from bisect import bisect
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 OMAP_ENTRY = "OmapFromSrc" / Struct(
     "From" / Int32ul,
     "To" / Int32ul,
@@ -17,6 +22,7 @@ class Omap(object):
         self.omap = OMAP_ENTRIES.parse(omapstream)
 
         self._froms = None
+        self._tos = None
 
     def remap(self, address):
         if not self._froms:
@@ -30,3 +36,45 @@ class Omap(object):
             return self.omap[pos].To
         else:
             return self.omap[pos].To + (address - self.omap[pos].From)
+
+    def remap_many(self, addresses):
+        """Remap many addresses at once, each like remap() does.
+
+        Returns a numpy array for a numpy array of addresses, a list
+        otherwise. Addresses remap() raises IndexError for (past the start
+        of the last entry) are remapped to -1.
+        """
+        if self._tos is None:
+            self._froms = [o.From for o in self.omap]
+            self._tos = [o.To for o in self.omap]
+        froms, tos = self._froms, self._tos
+        count = len(froms)
+
+        if numpy is not None and isinstance(addresses, numpy.ndarray):
+            if not count:
+                return numpy.full(len(addresses), -1, dtype = numpy.int64)
+            from_array = numpy.array(froms, dtype = numpy.int64)
+            to_array = numpy.array(tos, dtype = numpy.int64)
+            pos = numpy.searchsorted(from_array, addresses, side = "right")
+            past_end = pos >= count
+            # Like remap(), an address before the first entry wraps around
+            # to the last one
+            pos -= 1
+            to = to_array[pos]
+            remapped = numpy.where(to == 0, 0, to + (addresses - from_array[pos]))
+            remapped[past_end] = -1
+            return remapped
+
+        remapped = []
+        for address in addresses:
+            pos = bisect(froms, address)
+            if pos >= count:
+                remapped.append(-1)
+                continue
+            # bisect() returns the position past entries equal to address
+            pos = pos - 1
+            if tos[pos] == 0:
+                remapped.append(0)
+            else:
+                remapped.append(tos[pos] + (address - froms[pos]))
+        return remapped
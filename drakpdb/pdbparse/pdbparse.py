@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 from __future__ import absolute_import
 
-from struct import unpack, calcsize
+import os
+import threading
+from collections import namedtuple
+from struct import unpack, unpack_from, calcsize
+
+from .msf import DEFAULT_CACHE_SIZE, MSFFile
 
 PDB_STREAM_ROOT = 0  # PDB root directory
 PDB_STREAM_PDB = 1  # PDB stream info
@@ -30,9 +35,21 @@ def _pages(length, pagesize):
 
 
 class StreamFile:
+    """File-like object over the pages of a single stream.
+
+    fp: the MSFFile (or a plain file object) holding the PDB
+    pages: the list of pages that make up the stream
+
+    The pages touched by the last read are kept around, so construct's
+    many small sequential reads are mostly slices of the same buffer.
+    """
 
     def __init__(self, fp, pages, size=-1, page_size=0x1000):
         self.fp = fp
+        if isinstance(fp, MSFFile):
+            self.msf = fp
+        else:
+            self.msf = MSFFile(fp, page_size=page_size)
         self.pages = pages
         self.page_size = page_size
         if size == -1:
@@ -40,20 +57,26 @@ class StreamFile:
         else:
             self.end = size
         self.pos = 0
+        self._view = None
+        self._window = b""
+        self._window_start = 0
 
     def read(self, size=-1):
-        if size == -1:
-            pn_start, off_start = self._get_page(self.pos)
-            pdata = self._read_pages(self.pages[pn_start:])
-            self.pos = self.end
-            return pdata[off_start:self.end - off_start]
-        else:
-            pn_start, off_start = self._get_page(self.pos)
-            pn_end, off_end = self._get_page(self.pos + size)
-            pdata = self._read_pages(self.pages[pn_start:pn_end + 1])
-            self.pos += size
+        if size < 0 or self.pos + size > self.end:
+            size = max(self.end - self.pos, 0)
+        data = self._read_range(self.pos, size)
+        self.pos += size
+        return data
 
-            return pdata[off_start:-(self.page_size - off_end)]
+    def view(self):
+        """Return the whole stream as a bytes-like object.
+
+        No data is copied when the stream pages are contiguous. The result
+        is memoized, so following calls are free.
+        """
+        if self._view is None:
+            self._view = self.msf.read_pages(self.pages, self.end)
+        return self._view
 
     def seek(self, offset, whence=0):
         if whence == 0:
@@ -78,18 +101,30 @@ class StreamFile:
     def _get_page(self, offset):
         return (offset // self.page_size, offset % self.page_size)
 
+    def _read_range(self, offset, size):
+        if self._view is not None:
+            return bytes(self._view[offset:offset + size])
+
+        start = offset - self._window_start
+        if start >= 0 and start + size <= len(self._window):
+            return bytes(self._window[start:start + size])
+
+        if size == 0:
+            return b""
+        pn_start, off_start = self._get_page(offset)
+        pn_end, _ = self._get_page(offset + size - 1)
+        self._window = self._read_pages(self.pages[pn_start:pn_end + 1])
+        self._window_start = pn_start * self.page_size
+        return bytes(self._window[off_start:off_start + size])
+
     def _read_pages(self, pages):
-        s = b""
-        for pn in pages:
-            self.fp.seek(pn * self.page_size)
-            s += self.fp.read(self.page_size)
-        return s
+        return self.msf.read_pages(pages)
 
 
 class PDBStream:
     """Base class for PDB stream types.
 
-    data: the data that makes up this stream
+    data: the data that makes up this stream, as a bytes-like object
     index: the index of this stream in the file
     page_size: the size of a page, in bytes, of the PDB file
         containing this stream
@@ -99,11 +134,7 @@ class PDBStream:
     """
 
     def _get_data(self):
-        pos = self.stream_file.tell()
-        self.stream_file.seek(0)
-        data = self.stream_file.read()
-        self.stream_file.seek(pos)
-        return data
+        return self.stream_file.view()
 
     data = property(fget=_get_data)
 
@@ -148,10 +179,44 @@ class ParsedPDBStream(PDBStream):
                  parent=None):
         PDBStream.__init__(
             self, fp, pages, index, size=size, page_size=page_size, fast_load=fast_load, parent=parent)
-        if fast_load:
-            return
-        else:
-            if self.size != 0: self.load()
+        # Unless fast_load is set, the stream is parsed on first access to
+        # any of the attributes set by load(), see __getattr__
+        self.loaded = fast_load
+        self._loading = False
+        self._load_lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set (yet)
+        if name.startswith("_") or self.__dict__.get("loaded", True):
+            raise AttributeError(name)
+        if not self.ensure_loaded():
+            raise AttributeError(name)
+        return getattr(self, name)
+
+    def ensure_loaded(self):
+        """Parses the stream unless it was already done.
+
+        Safe to call from many threads, the stream is parsed only once.
+        Returns False when called by load() of this very stream.
+        """
+        if self.loaded:
+            return True
+        with self._load_lock:
+            if self.loaded:
+                return True
+            if self._loading:
+                return False
+            self._loading = True
+            try:
+                if self.size != 0:
+                    self.load()
+                    # Second stage init. Currently only used for FPO strings
+                    if hasattr(self, 'load2'):
+                        self.load2()
+            finally:
+                self._loading = False
+            self.loaded = True
+        return True
 
     def load(self):
         pass
@@ -257,17 +322,44 @@ class PDBInfoStream(ParsedPDBStream):
 
 class PDBTypeStream(ParsedPDBStream):
 
-    def load(self, unnamed_hack=True, elim_fwdrefs=True):
+    def load(self, unnamed_hack=True, elim_fwdrefs=True, lazy=True):
+        # Types are decoded on first access, see tpi.LazyTypes
         from . import tpi
-        tpis = tpi.parse_stream(self.stream_file, unnamed_hack, elim_fwdrefs)
+        tpis = tpi.parse_stream(self.stream_file, unnamed_hack, elim_fwdrefs, lazy=lazy)
         self.header = tpis.TPIHeader
         self.num_types = self.header.ti_max - self.header.ti_min
         self.types = tpis.types
-        self.structures = dict((s.name, s)
-                               for s in tpis.types.values()
-                               if s.leaf_type == "LF_STRUCTURE" or s.leaf_type == "LF_STRUCTURE_ST")
+        hash_sn = self.header.TPIHash.sn
+        if lazy and self.parent and hash_sn != 0xFFFF and hash_sn < len(self.parent.streams):
+            # Used for lookups by name, see find_type()
+            self.types.hash_data = self.parent.streams[hash_sn].data
+        self._structures = None
         del tpis
 
+    def find_type(self, name):
+        """Looks up a structure, union or enum by name, using the TPI hash
+        stream. Returns None if there's no such type."""
+        from . import tpi
+        if isinstance(self.types, tpi.LazyTypes):
+            return self.types.find_type(name)
+        found = None
+        for t in self.types.values():
+            if getattr(t, 'name', None) == name and hasattr(t, 'prop') and not t.prop.fwdref:
+                found = t
+        return found
+
+    @property
+    def structures(self):
+        # Needs all types, so it's only built when asked for
+        if self._structures is None:
+            from . import tpi
+            # v2 leaf types are renamed to v7 ones by then
+            lf_structure = tpi.LEAF_TYPE_CODES["LF_STRUCTURE"]
+            self._structures = dict((s.name, s)
+                                    for s in self.types.values()
+                                    if int(s.leaf_type) == lf_structure)
+        return self._structures
+
 
 class PDBDebugStream(ParsedPDBStream):
 
@@ -288,6 +380,8 @@ class PDBDebugStream(ParsedPDBStream):
         if self.parent:
             if debug.DBIHeader.symrecStream != -1:
                 self.parent.add_supported_stream("STREAM_GSYM", debug.DBIHeader.symrecStream, PDBGlobalSymbolStream)
+            if debug.DBIHeader.pssymStream != -1:
+                self.parent.add_supported_stream("STREAM_PSGSI", debug.DBIHeader.pssymStream, PDBPublicSymbolStream)
             if debug.DBIDbgHeader.snSectionHdr != -1:
                 self.parent.add_supported_stream("STREAM_SECT_HDR", debug.DBIDbgHeader.snSectionHdr, PDBSectionStream)
             if debug.DBIDbgHeader.snSectionHdrOrig != -1:
@@ -354,6 +448,9 @@ class PDBOmapStream(ParsedPDBStream):
     def remap(self, addr):
         return self.omap_data.remap(addr)
 
+    def remap_many(self, addrs):
+        return self.omap_data.remap_many(addrs)
+
 
 class PDBSectionStream(ParsedPDBStream):
 
@@ -364,14 +461,28 @@ class PDBSectionStream(ParsedPDBStream):
 
 class PDBGlobalSymbolStream(ParsedPDBStream):
 
-    def load(self):
+    # Decoded on first access to any of them, lookups with find_symbol()
+    # don't need them
+    _decoded_attrs = ("symbols", "globals", "vars", "funcs")
+
+    def __getattr__(self, name):
+        if name in self._decoded_attrs and self.__dict__.get("loaded", True):
+            with self._load_lock:
+                if name not in self.__dict__:
+                    self._decode()
+            return self.__dict__[name]
+        return ParsedPDBStream.__getattr__(self, name)
+
+    def _decode(self):
         from . import gdata
-        self.globals = gdata.parse_stream(self.stream_file)
+        # Public, data and procedure reference symbols, see gdata.decode_symbols
+        self.symbols = list(gdata.decode_symbols(self.data))
+        # Only public symbols, like the records with data that
+        # gdata.parse_stream used to return here
+        self.globals = [g for g in self.symbols if type(g) is gdata.PublicSymbol]
         self.vars = {}
         self.funcs = {}
         for g in self.globals:
-            if not hasattr(g, 'symtype'):
-                continue
             if g.symtype == 0:
                 if g.name.startswith("_"):
                     self.vars[g.name[1:]] = g
@@ -380,6 +491,61 @@ class PDBGlobalSymbolStream(ParsedPDBStream):
             elif g.symtype == 2:
                 self.funcs[g.name] = g
 
+    def _hash_tables(self):
+        # Hash tables of global (GSI) and public (PSGSI) symbols
+        tables = self.__dict__.get("_tables")
+        if tables is not None:
+            return tables
+        from . import gsi
+        tables = []
+        header = self.parent.STREAM_DBI.DBIHeader
+        streams = self.parent.streams
+        if 0 <= header.gssymStream < len(streams):
+            try:
+                tables.append(gsi.GSIHashTable(streams[header.gssymStream].data))
+            except ValueError:
+                pass
+        if 0 <= header.pssymStream < len(streams):
+            data = streams[header.pssymStream].data
+            try:
+                if len(data) < gsi.PSGSIHeader.sizeof():
+                    raise ValueError("Public symbol stream is truncated")
+                start = gsi.PSGSIHeader.sizeof()
+                size = gsi.PSGSIHeader.parse(data).SymHash
+                tables.append(gsi.GSIHashTable(data[start:start + size]))
+            except ValueError:
+                pass
+        self._tables = tables
+        return tables
+
+    def find_symbol(self, name):
+        """Looks up public, data and procedure reference symbols named `name`
+        (see gdata.decode_symbols) using the hash tables of global and
+        public symbols. Only the records in the hash bucket of the name are
+        decoded. Returns a list of the symbols found."""
+        from . import gdata
+        tables = self._hash_tables() if self.parent else []
+        if not tables:
+            return [sym for sym in self.symbols if sym.name == name]
+        offsets = []
+        for table in tables:
+            offsets.extend(table.lookup(name))
+        return [sym for sym in gdata.decode_symbols_at(self.data, offsets) if sym.name == name]
+
+
+class PDBPublicSymbolStream(ParsedPDBStream):
+
+    def load(self):
+        from . import gsi
+        self.header, self.addr_map = gsi.parse_address_map(self.data)
+
+    def publics(self):
+        """Yields public symbols sorted by their section:offset address,
+        decoded straight from the global symbol stream"""
+        from . import gdata
+        gsym_sn = self.parent.STREAM_DBI.gsym_file
+        return gdata.decode_symbols_at(self.parent.streams[gsym_sn].data, self.addr_map)
+
 
 # Symbolic names for streams
 _stream_names7 = {
@@ -408,10 +574,62 @@ _stream_types2 = {
 }
 
 
+class _NamedStream:
+    """Lazy accessor of a stream by its symbolic name, e.g. PDB.STREAM_TPI.
+
+    The stream is parsed on first access and cached in the PDB instance, so
+    only the streams that are actually used are ever decoded. Most names
+    are defined by the DBI stream (STREAM_GSYM, STREAM_SECT_HDR, ...), so
+    asking for them parses the DBI stream first.
+
+    With fast_load, nothing is parsed implicitly and only the names known
+    so far can be resolved.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, pdb, owner=None):
+        if pdb is None:
+            return self
+        index = pdb._stream_names.get(self.name)
+        if index is None and not pdb.fast_load and self.name != "STREAM_DBI":
+            # Registers names of the streams described by DBI
+            pdb.STREAM_DBI
+            index = pdb._stream_names.get(self.name)
+        if index is None or index >= len(pdb.streams):
+            raise AttributeError(self.name)
+        stream = pdb.streams[index]
+        if not pdb.fast_load and isinstance(stream, ParsedPDBStream):
+            stream.ensure_loaded()
+        pdb.__dict__[self.name] = stream
+        return stream
+
+
 class PDB:
 
-    def __init__(self, fp, fast_load=False):
-        self.fp = fp
+    STREAM_TPI = _NamedStream()
+    STREAM_PDB = _NamedStream()
+    STREAM_DBI = _NamedStream()
+    STREAM_GSYM = _NamedStream()
+    STREAM_PSGSI = _NamedStream()
+    STREAM_SECT_HDR = _NamedStream()
+    STREAM_SECT_HDR_ORIG = _NamedStream()
+    STREAM_OMAP_TO_SRC = _NamedStream()
+    STREAM_OMAP_FROM_SRC = _NamedStream()
+    STREAM_FPO = _NamedStream()
+    STREAM_FPO_NEW = _NamedStream()
+    STREAM_XDATA = _NamedStream()
+    STREAM_PDATA = _NamedStream()
+    STREAM_TOKEN_RID_MAP = _NamedStream()
+
+    def __init__(self, fp, fast_load=False, use_mmap=True):
+        if isinstance(fp, MSFFile):
+            self.fp = fp.fp
+            self.msf = fp
+        else:
+            self.fp = fp
+            self.msf = MSFFile(fp, use_mmap=use_mmap)
         self.fast_load = fast_load
         self.page_size = None
         self._stream_map = {}
@@ -424,29 +642,31 @@ class PDB:
             * (list) pages: a list of page numbers that make up the data requested
             * (int) size: the number of bytes requested. Must be <= len(pages)*self.page_size
         Return :
-            * (bytes) the data read
+            * (bytes-like) the data read
         """
 
         assert size <= len(pages) * self.page_size
 
-        pos = self.fp.tell()
-        s = b''
-        for pn in pages:
-            self.fp.seek(pn * self.page_size)
-            s += self.fp.read(self.page_size)
-        self.fp.seek(pos)
-        if size == -1:
-            return s
-        else:
-            return s[:size]
+        return self.msf.read_pages(pages, size)
 
     def add_supported_stream(self, name, index, cls):
         self._stream_map[index] = cls
-        self._stream_names[name] = index
 
-    def _update_names(self):
-        for k, v in self._stream_names.items():
-            setattr(self, k, self.streams[v])
+        # Streams described by DBI are known only after the root stream
+        # was read, so they have to be specialized afterwards. It's done
+        # before the name is published for other threads.
+        streams = self.__dict__.get("streams")
+        if streams is not None and index < len(streams) and type(streams[index]) is not cls:
+            stream = streams[index]
+            streams[index] = cls(
+                self.msf,
+                stream.pages,
+                index,
+                size=stream.size,
+                page_size=self.page_size,
+                fast_load=self.fast_load,
+                parent=self)
+        self._stream_names[name] = index
 
     def read_root(self, rs):
         self.streams = []
@@ -458,7 +678,7 @@ class PDB:
             stream_size, stream_pages = rs.streams[i]
             self.streams.append(
                 pdb_cls(
-                    self.fp,
+                    self.msf,
                     stream_pages,
                     i,
                     size=stream_size,
@@ -466,31 +686,26 @@ class PDB:
                     fast_load=self.fast_load,
                     parent=self))
 
-        # Sets up access to streams by name
-        self._update_names()
-
-        # Second stage init. Currently only used for FPO strings
-        if not self.fast_load:
-            for s in self.streams:
-                if hasattr(s, 'load2'):
-                    s.load2()
+        # Streams are parsed lazily, on first access by name (see
+        # _NamedStream) or to any of their parsed attributes
 
 
 class PDB7(PDB):
     """Class representing a Microsoft PDB file, version 7.
 
-    This class loads and parses each stream contained in the
-    file, and places it in the "streams" member.
+    This class loads each stream contained in the file and places
+    it in the "streams" member. Streams are parsed on first use.
 
     """
 
-    def __init__(self, fp, fast_load=False):
-        PDB.__init__(self, fp, fast_load)
+    def __init__(self, fp, fast_load=False, use_mmap=True):
+        PDB.__init__(self, fp, fast_load, use_mmap)
         (self.signature, self.page_size, alloc_table_ptr, self.num_file_pages, root_size,
-         reserved) = unpack(_PDB7_FMT, self.fp.read(_PDB7_FMT_SIZE))
+         reserved) = unpack(_PDB7_FMT, self.msf.read(0, _PDB7_FMT_SIZE))
 
         if self.signature != _PDB7_SIGNATURE:
             raise ValueError("Invalid signature for PDB version 7")
+        self.msf.page_size = self.page_size
 
         self._stream_map = dict(_stream_types7)
         self._stream_names = dict(_stream_names7)
@@ -501,35 +716,31 @@ class PDB7(PDB):
         # How many pages are needed to store the root page list?
         num_root_index_pages = _pages(num_root_pages * 4, self.page_size)
         root_index_array_fmt = "<" + ("%dI" % num_root_index_pages)
-        root_index_pages = unpack(root_index_array_fmt, self.fp.read(num_root_index_pages * 4))
+        root_index_pages = unpack(root_index_array_fmt, self.msf.read(_PDB7_FMT_SIZE, num_root_index_pages * 4))
 
         # Read in the root page list
-        root_page_data = b""
-        for root_index in root_index_pages:
-            self.fp.seek(root_index * self.page_size)
-            root_page_data += self.fp.read(self.page_size)
+        root_page_data = self.msf.read_pages(root_index_pages, num_root_pages * 4)
 
         # Unpack
         page_list_fmt = "<" + ("%dI" % num_root_pages)
-        root_page_list = unpack(page_list_fmt, root_page_data[:num_root_pages * 4])
-
-        # root_stream_data = self.read(root_page_list, root_size)
+        root_page_list = unpack_from(page_list_fmt, root_page_data)
 
         self.root_stream = PDB7RootStream(
-            self.fp, root_page_list, index=PDB_STREAM_ROOT, size=root_size, page_size=self.page_size)
+            self.msf, root_page_list, index=PDB_STREAM_ROOT, size=root_size, page_size=self.page_size)
 
         self.read_root(self.root_stream)
 
 
 class PDB2(PDB):
 
-    def __init__(self, fp, fast_load=False):
-        PDB.__init__(self, fp, fast_load)
+    def __init__(self, fp, fast_load=False, use_mmap=True):
+        PDB.__init__(self, fp, fast_load, use_mmap)
         (self.signature, self.page_size, start_page, self.num_file_pages, root_size,
-         reserved) = unpack(_PDB2_FMT, self.fp.read(_PDB2_FMT_SIZE))
+         reserved) = unpack(_PDB2_FMT, self.msf.read(0, _PDB2_FMT_SIZE))
 
         if self.signature != _PDB2_SIGNATURE:
             raise ValueError("Invalid signature for PDB version 2")
+        self.msf.page_size = self.page_size
 
         self._stream_map = dict(_stream_types2)
         self._stream_names = dict(_stream_names2)
@@ -538,23 +749,95 @@ class PDB2(PDB):
         num_root_pages = _pages(root_size, self.page_size)
 
         page_list_fmt = "<" + ("%dH" % num_root_pages)
-        root_page_list = unpack(page_list_fmt, self.fp.read(num_root_pages * 2))
+        root_page_list = unpack(page_list_fmt, self.msf.read(_PDB2_FMT_SIZE, num_root_pages * 2))
 
-        self.root_stream = PDB2RootStream(self.fp, root_page_list, index=PDB_STREAM_ROOT, page_size=self.page_size)
+        self.root_stream = PDB2RootStream(self.msf, root_page_list, index=PDB_STREAM_ROOT, page_size=self.page_size)
 
         self.read_root(self.root_stream)
 
 
-def parse(filename, fast_load=False):
-    "Open a PDB file and autodetect its version"
-    f = open(filename, 'rb')
-    sig = f.read(_PDB7_SIGNATURE_LEN)
-    f.seek(0)
+def _parse_msf(msf, fast_load):
+    sig = bytes(msf.read(0, _PDB7_SIGNATURE_LEN))
     if sig == _PDB7_SIGNATURE:
-        return PDB7(f, fast_load)
+        return PDB7(msf, fast_load)
     else:
-        sig = f.read(_PDB2_SIGNATURE_LEN)
+        sig = bytes(msf.read(0, _PDB2_SIGNATURE_LEN))
         if sig == _PDB2_SIGNATURE:
-            f.seek(0)
-            return PDB2(f, fast_load)
+            return PDB2(msf, fast_load)
     raise ValueError("Unsupported file type")
+
+
+def parse(filename, fast_load=False, use_mmap=True, cache_size=DEFAULT_CACHE_SIZE):
+    """Open a PDB file and autodetect its version
+
+    The file is memory-mapped unless use_mmap is False. In that case
+    pages are read through an LRU cache holding up to cache_size bytes.
+    """
+    f = open(filename, 'rb')
+    msf = None
+    try:
+        msf = MSFFile(f, use_mmap=use_mmap, cache_size=cache_size)
+        return _parse_msf(msf, fast_load)
+    except BaseException:
+        # Not a PDB file, or a broken one
+        if msf is not None:
+            msf.close()
+        else:
+            f.close()
+        raise
+
+
+def parse_bytes(data, fast_load=False):
+    """Parse a PDB held in memory and autodetect its version
+
+    data may be any bytes-like object (bytes, bytearray, memoryview, mmap).
+    Streams are read as views into it, so it's never copied as a whole.
+    """
+    return _parse_msf(MSFFile(data), fast_load)
+
+
+PDBProbe = namedtuple("PDBProbe", ["Version", "TimeDateStamp", "Age", "GUID", "Machine", "size"])
+PDBProbe.__doc__ = """Identity of a PDB file, as returned by probe()"""
+
+
+def _probe_pdb(pdb, size):
+    from . import dbi
+
+    info = pdb.streams[PDB_STREAM_PDB]
+    if not isinstance(info, PDBInfoStream):
+        raise ValueError("PDB has no info stream")
+    info.load()
+
+    machine = None
+    if len(pdb.streams) > PDB_STREAM_DBI and pdb.streams[PDB_STREAM_DBI].size != 0:
+        stream = pdb.streams[PDB_STREAM_DBI].stream_file
+        machine = str(dbi.DBIHeader.parse(stream.read(dbi.DBIHeader.sizeof())).Machine)
+
+    return PDBProbe(
+        Version=info.Version,
+        TimeDateStamp=info.TimeDateStamp,
+        Age=info.Age,
+        GUID=info.GUID,
+        Machine=machine,
+        size=size,
+    )
+
+
+def probe(filename):
+    """Read the identity of a PDB file without parsing it
+
+    Only the superblock, the root directory, the info stream and the header
+    of the DBI stream are read. Returns a PDBProbe, which can be passed to
+    drakpdb.make_symstore_hash like PDB.STREAM_PDB.
+    """
+    # A handful of pages is read, mapping the file isn't worth it
+    pdb = parse(filename, fast_load=True, use_mmap=False)
+    try:
+        return _probe_pdb(pdb, os.path.getsize(filename))
+    finally:
+        pdb.msf.close()
+
+
+def probe_bytes(data):
+    """Read the identity of a PDB held in memory, like probe()"""
+    return _probe_pdb(parse_bytes(data, fast_load=True), len(data))
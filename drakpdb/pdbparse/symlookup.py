@@ -1,8 +1,8 @@
 import os
-from bisect import bisect_right
-from operator import itemgetter, attrgetter
+from operator import attrgetter
 
 from .pdbparse import parse
+from .symtable import SymbolTable
 
 
 class DummyOmap(object):
@@ -10,6 +10,9 @@ class DummyOmap(object):
     def remap(self, addr):
         return addr
 
+    def remap_many(self, addrs):
+        return addrs
+
 
 class Lookup(object):
 
@@ -27,29 +30,9 @@ class Lookup(object):
                 continue
 
             # print ("Loading symbols for %s..." % pdbbase)
-            try:
-                # Do this the hard way to avoid having to load
-                # the types stream in mammoth PDB files
-                pdb = parse(pdbname, fast_load = True)
-                pdb.STREAM_DBI.load()
-                pdb._update_names()
-                pdb.STREAM_GSYM = pdb.STREAM_GSYM.reload()
-                if pdb.STREAM_GSYM.size:
-                    pdb.STREAM_GSYM.load()
-                pdb.STREAM_SECT_HDR = pdb.STREAM_SECT_HDR.reload()
-                pdb.STREAM_SECT_HDR.load()
-                # These are the dicey ones
-                pdb.STREAM_OMAP_FROM_SRC = pdb.STREAM_OMAP_FROM_SRC.reload()
-                pdb.STREAM_OMAP_FROM_SRC.load()
-                pdb.STREAM_SECT_HDR_ORIG = pdb.STREAM_SECT_HDR_ORIG.reload()
-                pdb.STREAM_SECT_HDR_ORIG.load()
-
-            except AttributeError as e:
-                pass
-            # except Exception as e:
-            #    print ("WARN: error %s parsing %s, skipping" % (e,pdbbase))
-            #    not_found.append( (base, pdbbase) )
-            #    continue
+            # Streams are parsed on first access, so the types stream of
+            # mammoth PDB files is never loaded here
+            pdb = parse(pdbname)
 
             try:
                 sects = pdb.STREAM_SECT_HDR_ORIG.sections
@@ -59,37 +42,22 @@ class Lookup(object):
                 # headers and use the identity function for omap.remap
                 sects = pdb.STREAM_SECT_HDR.sections
                 omap = DummyOmap()
-            gsyms = pdb.STREAM_GSYM
-            if not hasattr(gsyms, 'globals'):
-                gsyms.globals = []
+            try:
+                publics = pdb.STREAM_PSGSI.publics()
+            except (AttributeError, ValueError):
+                gsyms = pdb.STREAM_GSYM
+                if not hasattr(gsyms, 'globals'):
+                    gsyms.globals = []
+                publics = gsyms.globals
 
             last_sect = max(sects, key = attrgetter('VirtualAddress'))
             limit = base + last_sect.VirtualAddress + last_sect.Misc.VirtualSize
 
+            symbols = SymbolTable(publics)
+            symbols.map(sects, omap, base)
             self.addrs[base, limit] = {}
             self.addrs[base, limit]['name'] = pdbbase
-            self.addrs[base, limit]['addrs'] = []
-            for sym in gsyms.globals:
-                if not hasattr(sym, 'offset'):
-                    continue
-                off = sym.offset
-                try:
-                    virt_base = sects[sym.segment - 1].VirtualAddress
-                except IndexError:
-                    continue
-
-                mapped = omap.remap(off + virt_base) + base
-                self.addrs[base, limit]['addrs'].append((mapped, sym.name))
-
-            self.addrs[base, limit]['addrs'].sort(key = itemgetter(0))
-
-        self.locs = {}
-        self.names = {}
-        for base, limit in self.addrs:
-            mod = self.addrs[base, limit]['name']
-            symbols = self.addrs[base, limit]['addrs']
-            self.locs[base, limit] = [a[0] for a in symbols]
-            self.names[base, limit] = [a[1] for a in symbols]
+            self.addrs[base, limit]['symbols'] = symbols
 
     def lookup(self, loc):
         if loc in self._cache:
@@ -98,15 +66,15 @@ class Lookup(object):
         for base, limit in self.addrs:
             if loc >= base and loc < limit:
                 mod = self.addrs[base, limit]['name']
-                symbols = self.addrs[base, limit]['addrs']
-                locs = self.locs[base, limit]
-                names = self.names[base, limit]
-                idx = bisect_right(locs, loc) - 1
-                diff = loc - locs[idx]
-                if diff:
-                    ret = "%s!%s+%#x" % (mod, names[idx], diff)
+                found = self.addrs[base, limit]['symbols'].lookup(loc)
+                if found is None:
+                    ret = "%s+%#x" % (mod, loc - base)
                 else:
-                    ret = "%s!%s" % (mod, names[idx])
+                    name, diff = found
+                    if diff:
+                        ret = "%s!%s+%#x" % (mod, name, diff)
+                    else:
+                        ret = "%s!%s" % (mod, name)
                 self._cache[loc] = ret
                 return ret
         return "unknown"
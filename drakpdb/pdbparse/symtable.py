@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""Public symbols of a PDB as parallel arrays.
+
+A SymbolTable keeps the segment, offset, flags and name index of each
+symbol in arrays (numpy arrays if numpy is installed), so that mapping
+symbols to addresses and sorting them runs over all symbols at once.
+"""
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _column(values):
+    if numpy is not None:
+        return numpy.frombuffer(values, dtype = numpy.uint32)
+    return values
+
+
+def _group_order(keys, addresses, presorted):
+    """Returns the order of symbols sorted by (key, address), with keys
+    ordered by their first occurrence"""
+    _, first, inverse = numpy.unique(keys, return_index = True, return_inverse = True)
+    rank = numpy.empty(len(first), dtype = numpy.int64)
+    rank[numpy.argsort(first, kind = "stable")] = numpy.arange(len(first))
+    if presorted:
+        # A stable sort keeps the address order within each key
+        return numpy.argsort(rank[inverse], kind = "stable")
+    return numpy.lexsort((addresses, rank[inverse]))
+
+
+def _is_sorted(addresses):
+    if numpy is not None:
+        return bool(numpy.all(addresses[1:] >= addresses[:-1]))
+    return all(a <= b for a, b in zip(addresses, addresses[1:]))
+
+
+class SymbolTable(object):
+    """Public symbols as parallel arrays of segments, offsets, flags (the
+    symtype of S_PUB32 records) and indexes into names.
+
+    symbols: symbols as decoded by gdata, records other than public
+             symbols are skipped
+    """
+
+    def __init__(self, symbols):
+        self.names = []
+        name_indexes = {}
+        segments = array("I")
+        offsets = array("I")
+        flags = array("I")
+        name_index = array("I")
+        for sym in symbols:
+            symtype = getattr(sym, "symtype", None)
+            if symtype is None:
+                continue
+            index = name_indexes.get(sym.name)
+            if index is None:
+                index = name_indexes[sym.name] = len(self.names)
+                self.names.append(sym.name)
+            segments.append(sym.segment)
+            offsets.append(sym.offset)
+            flags.append(symtype)
+            name_index.append(index)
+
+        self.segments = _column(segments)
+        self.offsets = _column(offsets)
+        self.flags = _column(flags)
+        self.name_index = _column(name_index)
+
+        # Set by map(): indexes of mapped symbols and their addresses, in
+        # symbol order, and whether that's the address order too (as with
+        # publics from the PSGSI address map), so no sorting is needed
+        self.indexes = None
+        self.addresses = None
+        self.presorted = False
+        self._by_address = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def map(self, sections, omap = None, base = 0):
+        """Computes addresses of the symbols, relative to `base`.
+
+        sections: section headers, segments of symbols are 1-based indexes
+                  of them
+        omap: remaps addresses with remap_many() if given
+
+        Symbols in missing sections, and ones the OMAP can't remap, are
+        left out.
+        """
+        bases = [s.VirtualAddress for s in sections]
+        count = len(bases)
+        # Segment 0 maps to the last section, the way sections[-1] does
+        if numpy is not None:
+            indexes = numpy.flatnonzero(self.segments <= count) if count else numpy.arange(0)
+            segments = self.segments[indexes].astype(numpy.int64)
+            addresses = numpy.array(bases, dtype = numpy.int64)[segments - 1]
+            addresses += self.offsets[indexes]
+            if omap is not None:
+                addresses = omap.remap_many(addresses)
+                mapped = addresses >= 0
+                indexes, addresses = indexes[mapped], addresses[mapped]
+            addresses += base
+        else:
+            indexes = array("I")
+            addresses = []
+            for i, (segment, offset) in enumerate(zip(self.segments, self.offsets)):
+                if count and segment <= count:
+                    indexes.append(i)
+                    addresses.append(bases[segment - 1] + offset)
+            if omap is not None:
+                addresses = omap.remap_many(addresses)
+                mapped = [i for i, address in enumerate(addresses) if address >= 0]
+                if len(mapped) != len(addresses):
+                    indexes = array("I", [indexes[i] for i in mapped])
+                    addresses = [addresses[i] for i in mapped]
+            if base:
+                addresses = [address + base for address in addresses]
+        self.indexes = indexes
+        self.addresses = addresses
+        self.presorted = _is_sorted(addresses)
+        self._by_address = None
+
+    def groups(self, names = None, flag_mask = 0, flag_value = 0):
+        """Yields (name, addresses) pairs of mapped symbols with
+        flags & flag_mask == flag_value. Names come in order of first
+        occurrence, addresses of each name are sorted.
+
+        names: names by name index, self.names by default. Symbols whose
+               names are equal there (e.g. once de-mangled) are grouped
+               together.
+        """
+        if names is None:
+            names = self.names
+        unique = {}
+        name_ids = array("I", [unique.setdefault(name, len(unique)) for name in names])
+        unique = list(unique)
+
+        if numpy is not None:
+            selected = self.indexes
+            if flag_mask:
+                selected = (self.flags[self.indexes] & flag_mask) == flag_value
+                selected, addresses = self.indexes[selected], self.addresses[selected]
+            else:
+                addresses = self.addresses
+            keys = numpy.frombuffer(name_ids, dtype = numpy.uint32)[self.name_index[selected]]
+            order = _group_order(keys, addresses, self.presorted)
+            if not len(order):
+                return
+            keys, addresses = keys[order], addresses[order]
+            starts = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+            for key, group in zip(keys[numpy.r_[0, starts]], numpy.split(addresses, starts)):
+                if len(group):
+                    yield unique[key], group.tolist()
+            return
+
+        groups = {}
+        for i, address in zip(self.indexes, self.addresses):
+            if self.flags[i] & flag_mask == flag_value:
+                key = name_ids[self.name_index[i]]
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = [address]
+                else:
+                    group.append(address)
+        for key, group in groups.items():
+            if not self.presorted:
+                group.sort()
+            yield unique[key], group
+
+    def lookup(self, address):
+        """Returns (name, displacement) of the mapped symbol at or
+        closest below `address`, or None if there is none"""
+        if self._by_address is None:
+            if numpy is not None:
+                order = slice(None)
+                if not self.presorted:
+                    order = numpy.argsort(self.addresses, kind = "stable")
+                self._by_address = (
+                    self.addresses[order].tolist(),
+                    self.name_index[self.indexes[order]].tolist(),
+                )
+            elif self.presorted:
+                self._by_address = (
+                    self.addresses,
+                    [self.name_index[i] for i in self.indexes],
+                )
+            else:
+                order = sorted(range(len(self.addresses)), key = self.addresses.__getitem__)
+                self._by_address = (
+                    [self.addresses[i] for i in order],
+                    [self.name_index[self.indexes[i]] for i in order],
+                )
+        addresses, name_index = self._by_address
+        pos = bisect_right(addresses, address) - 1
+        if pos < 0:
+            return None
+        return self.names[name_index[pos]], address - addresses[pos]
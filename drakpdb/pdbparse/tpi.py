@@ -1,10 +1,17 @@
 #!/usr/bin/env python
 
 # Python 2 and 3
+import collections.abc
+import struct
+import threading
+from array import array
+from bisect import bisect_right
 from io import BytesIO
 
 from construct import *
 
+from .hashing import hash_string_v1
+
 # For each metatype, which attributes are references
 # to another type
 type_refs = {
@@ -600,6 +607,31 @@ leaf_type = "leaf_type" / Enum(
     LF_PAD15 = 0xff,
 )
 
+# Integer code <-> name tables of leaf and base types. Names are the shared
+# EnumIntegerString values of the enums, they are never created per record.
+LEAF_TYPE_CODES = dict(leaf_type.encmapping)
+LEAF_TYPE_NAMES = dict(leaf_type.decmapping)
+BASE_TYPE_NAMES = dict(base_type.decmapping)
+
+# Values below are stored inline, others are numeric leaves (see val())
+LF_NUMERIC = LEAF_TYPE_CODES["LF_CHAR"]
+
+
+def leaf_type_name(code):
+    """Name of a leaf type (EnumIntegerString), EnumInteger if unknown"""
+    try:
+        return LEAF_TYPE_NAMES[code]
+    except KeyError:
+        return EnumInteger(code)
+
+
+def base_type_name(code):
+    """Name of a base type (EnumIntegerString), EnumInteger if unknown"""
+    try:
+        return BASE_TYPE_NAMES[code]
+    except KeyError:
+        return EnumInteger(code)
+
 ### CodeView bitfields and enums
 # NOTE: Construct assumes big-endian
 # ordering for BitStructs
@@ -676,10 +708,10 @@ def val(name):
         "_value_name" / Computed(lambda ctx: name),
         "value_or_type" / Int16ul,
         "name_or_val" / IfThenElse(
-            lambda ctx: ctx.value_or_type < leaf_type._encode("LF_CHAR", ctx, None),
+            lambda ctx: ctx.value_or_type < LF_NUMERIC,
             "name" / CString(encoding = "utf8"),
             "val" / Switch(
-                lambda ctx: leaf_type._decode(ctx.value_or_type, {}, None),
+                lambda ctx: leaf_type_name(ctx.value_or_type),
                 {
                     "LF_CHAR": "char" / Struct(
                         "value" / Int8sl,
@@ -1048,6 +1080,467 @@ TPIStream = "TPIStream" / Struct(
 ### END PURE CONSTRUCT DATA ###
 
 
+### Fast decoder for the most common leaf types
+#
+# Decoding type records with the constructs above is slow, so the hot
+# leaf types are decoded with struct directly from the stream buffer.
+# The result is a compact TypeRecord with the same attributes as the
+# flattened Container that merge_subcon() and fix_value() make of the
+# construct output (without the leftover _pad). Records the fast decoder
+# doesn't handle (rare leaf types, v2 "_ST" variants, unusual numeric
+# leaves) are parsed with the Type construct as before.
+
+
+class TypeRecord(object):
+    """Base class of decoded types and fieldlist members.
+
+    Holds the same fields as the Container parsed by the construct, as
+    attributes only, in __slots__. Like with a Container, accessing a field
+    that is not there raises AttributeError.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = []
+        for name in self.__slots__:
+            value = getattr(self, name, None)
+            if isinstance(value, TypeRecord) and hasattr(value, 'tpi_idx'):
+                # Types may refer to each other, don't follow references
+                value = "<%s %#x>" % (value.leaf_type, value.tpi_idx)
+            else:
+                value = repr(value)
+            fields.append("%s=%s" % (name, value))
+        return "%s(%s)" % (type(self).__name__, ", ".join(fields))
+
+
+class StructType(TypeRecord):
+    """LF_STRUCTURE, LF_CLASS"""
+    __slots__ = ("length", "leaf_type", "count", "prop", "fieldlist", "derived", "vshape", "name", "size", "tpi_idx")
+
+
+class UnionType(TypeRecord):
+    """LF_UNION"""
+    __slots__ = ("length", "leaf_type", "count", "prop", "fieldlist", "name", "size", "tpi_idx")
+
+
+class EnumType(TypeRecord):
+    """LF_ENUM"""
+    __slots__ = ("length", "leaf_type", "count", "prop", "utype", "fieldlist", "name", "tpi_idx")
+
+
+class PointerType(TypeRecord):
+    """LF_POINTER"""
+    __slots__ = ("length", "leaf_type", "utype", "ptr_attr", "tpi_idx")
+
+
+class BitfieldType(TypeRecord):
+    """LF_BITFIELD, length is the number of bits"""
+    __slots__ = ("length", "leaf_type", "base_type", "position", "tpi_idx")
+
+
+class ArrayType(TypeRecord):
+    """LF_ARRAY"""
+    __slots__ = ("length", "leaf_type", "element_type", "index_type", "name", "size", "tpi_idx")
+
+
+class ModifierType(TypeRecord):
+    """LF_MODIFIER"""
+    __slots__ = ("length", "leaf_type", "modified_type", "modifier", "tpi_idx")
+
+
+class ProcedureType(TypeRecord):
+    """LF_PROCEDURE"""
+    __slots__ = ("length", "leaf_type", "return_type", "call_conv", "reserved", "parm_count", "arglist", "tpi_idx")
+
+
+class MemberFunctionType(TypeRecord):
+    """LF_MFUNCTION"""
+    __slots__ = ("length", "leaf_type", "return_type", "class_type", "this_type", "call_conv", "reserved",
+                 "parm_count", "arglist", "thisadjust", "tpi_idx")
+
+
+class ArgListType(TypeRecord):
+    """LF_ARGLIST"""
+    __slots__ = ("length", "leaf_type", "count", "arg_type", "tpi_idx")
+
+
+class FieldListType(TypeRecord):
+    """LF_FIELDLIST, substructs are the members"""
+    __slots__ = ("length", "leaf_type", "substructs", "tpi_idx")
+
+
+class UnknownType(TypeRecord):
+    """Any leaf type whose contents are not parsed"""
+    __slots__ = ("length", "leaf_type", "tpi_idx")
+
+
+class Member(TypeRecord):
+    """LF_MEMBER"""
+    __slots__ = ("leaf_type", "fldattr", "index", "name", "offset")
+
+
+class Enumerate(TypeRecord):
+    """LF_ENUMERATE"""
+    __slots__ = ("leaf_type", "fldattr", "name", "enum_value")
+
+
+class BaseClass(TypeRecord):
+    """LF_BCLASS"""
+    __slots__ = ("leaf_type", "fldattr", "index", "name", "offset")
+
+
+class VFuncTab(TypeRecord):
+    """LF_VFUNCTAB"""
+    __slots__ = ("leaf_type", "type")
+
+
+class OneMethod(TypeRecord):
+    """LF_ONEMETHOD"""
+    __slots__ = ("leaf_type", "fldattr", "index", "intro")
+
+
+class Method(TypeRecord):
+    """LF_METHOD"""
+    __slots__ = ("leaf_type", "count", "mlist", "name")
+
+
+class NestType(TypeRecord):
+    """LF_NESTTYPE"""
+    __slots__ = ("leaf_type", "index", "name")
+
+
+class UnknownMember(TypeRecord):
+    """Fieldlist member whose contents are not parsed"""
+    __slots__ = ("leaf_type",)
+
+_u16 = struct.Struct("<H")
+_u32 = struct.Struct("<I")
+
+# Numeric leaves of val(), as in the "val" Switch
+_numeric_leaves = {
+    LEAF_TYPE_CODES["LF_CHAR"]: struct.Struct("<b"),
+    LEAF_TYPE_CODES["LF_SHORT"]: struct.Struct("<h"),
+    LEAF_TYPE_CODES["LF_USHORT"]: struct.Struct("<H"),
+    LEAF_TYPE_CODES["LF_LONG"]: struct.Struct("<i"),
+    LEAF_TYPE_CODES["LF_ULONG"]: struct.Struct("<I"),
+    LEAF_TYPE_CODES["LF_QUADWORD"]: struct.Struct("<q"),
+    LEAF_TYPE_CODES["LF_UQUADWORD"]: struct.Struct("<Q"),
+}
+
+
+class _Fallback(Exception):
+    """Record can't be decoded by the fast decoder"""
+
+
+class _ParseError(Exception):
+    """Record is malformed, construct would fail to parse it as well"""
+
+
+def _memoized_parser(con):
+    """Parse small, fixed-size constructs (bit fields, enums) once per
+    distinct raw value. Parsed values are shared between records."""
+    cache = {}
+
+    def parse(data, pos, size):
+        raw = data[pos:pos + size]
+        try:
+            return cache[raw]
+        except KeyError:
+            if len(raw) != size:
+                raise _ParseError()
+            value = cache[raw] = con.parse(raw)
+            return value
+
+    return parse
+
+
+_parse_fldattr = _memoized_parser(CV_fldattr)
+_parse_property = _memoized_parser(CV_property)
+_parse_call = _memoized_parser(CV_call)
+_parse_modifier = _memoized_parser(lfModifier.subcons[1])
+_parse_ptr_attr = _memoized_parser(lfPointer.subcons[1])
+
+
+def _check_size(pos, size, end):
+    """Make sure size bytes at pos belong to the record ending at end"""
+    if pos + size > end:
+        raise _ParseError()
+
+
+def _cstring(data, pos, end):
+    nul = data.find(b"\0", pos, end)
+    if nul < 0:
+        raise _ParseError()
+    try:
+        return data[pos:nul].decode("utf8"), nul + 1
+    except UnicodeDecodeError:
+        raise _ParseError()
+
+
+def _value(data, pos, end):
+    """Decode val(): returns (value, name, new position)"""
+    _check_size(pos, 2, end)
+    (value,) = _u16.unpack_from(data, pos)
+    pos += 2
+    if value >= LF_NUMERIC:
+        numeric = _numeric_leaves.get(value)
+        if numeric is None:
+            raise _Fallback()
+        _check_size(pos, numeric.size, end)
+        (value,) = numeric.unpack_from(data, pos)
+        pos += numeric.size
+    name, pos = _cstring(data, pos, end)
+    return value, name, pos
+
+
+def _pad(data, pos, end):
+    """Decode the "_pad" Peek and skip PadAlign: returns (_pad, new position)"""
+    if pos >= end:
+        return None, pos
+    pad = data[pos]
+    if pad > 0xF0 and pos + (pad & 0x0F) <= end:
+        pos += pad & 0x0F
+    return pad, pos
+
+
+def _decode_structure(data, pos, end, length, lf):
+    _check_size(pos, 16, end)
+    count, = _u16.unpack_from(data, pos)
+    prop = _parse_property(data, pos + 2, 2)
+    fieldlist, derived, vshape = struct.unpack_from("<III", data, pos + 4)
+    size, name, pos = _value(data, pos + 16, end)
+    return StructType(length, lf, count, prop, fieldlist, derived, vshape, name, size)
+
+
+def _decode_union(data, pos, end, length, lf):
+    _check_size(pos, 8, end)
+    count, = _u16.unpack_from(data, pos)
+    prop = _parse_property(data, pos + 2, 2)
+    fieldlist, = _u32.unpack_from(data, pos + 4)
+    size, name, pos = _value(data, pos + 8, end)
+    return UnionType(length, lf, count, prop, fieldlist, name, size)
+
+
+def _decode_enum(data, pos, end, length, lf):
+    _check_size(pos, 12, end)
+    count, = _u16.unpack_from(data, pos)
+    prop = _parse_property(data, pos + 2, 2)
+    utype, fieldlist = struct.unpack_from("<II", data, pos + 4)
+    name, pos = _cstring(data, pos + 12, end)
+    return EnumType(length, lf, count, prop, utype, fieldlist, name)
+
+
+def _decode_pointer(data, pos, end, length, lf):
+    _check_size(pos, 8, end)
+    utype, = _u32.unpack_from(data, pos)
+    ptr_attr = _parse_ptr_attr(data, pos + 4, 4)
+    return PointerType(length, lf, utype, ptr_attr)
+
+
+def _decode_bitfield(data, pos, end, length, lf):
+    _check_size(pos, 6, end)
+    base_type, bit_length, position = struct.unpack_from("<IBB", data, pos)
+    # The bit length overwrites the record length, like merge_subcon() does
+    return BitfieldType(bit_length, lf, base_type, position)
+
+
+def _decode_array(data, pos, end, length, lf):
+    _check_size(pos, 8, end)
+    element_type, index_type = struct.unpack_from("<II", data, pos)
+    size, name, pos = _value(data, pos + 8, end)
+    return ArrayType(length, lf, element_type, index_type, name, size)
+
+
+def _decode_modifier(data, pos, end, length, lf):
+    _check_size(pos, 6, end)
+    modified_type, = _u32.unpack_from(data, pos)
+    modifier = _parse_modifier(data, pos + 4, 2)
+    return ModifierType(length, lf, modified_type, modifier)
+
+
+def _decode_procedure(data, pos, end, length, lf):
+    _check_size(pos, 12, end)
+    return_type, = _u32.unpack_from(data, pos)
+    call_conv = _parse_call(data, pos + 4, 1)
+    reserved, parm_count, arglist = struct.unpack_from("<BHI", data, pos + 5)
+    return ProcedureType(length, lf, return_type, call_conv, reserved, parm_count, arglist)
+
+
+def _decode_arglist(data, pos, end, length, lf):
+    _check_size(pos, 4, end)
+    count, = _u32.unpack_from(data, pos)
+    _check_size(pos + 4, count * 4, end)
+    arg_type = ListContainer(struct.unpack_from("<%dI" % count, data, pos + 4))
+    return ArgListType(length, lf, count, arg_type)
+
+
+def _decode_mfunction(data, pos, end, length, lf):
+    _check_size(pos, 24, end)
+    return_type, class_type, this_type = struct.unpack_from("<III", data, pos)
+    call_conv = _parse_call(data, pos + 12, 1)
+    reserved, parm_count, arglist, thisadjust = struct.unpack_from("<BHIi", data, pos + 13)
+    return MemberFunctionType(length, lf, return_type, class_type, this_type, call_conv, reserved, parm_count,
+                              arglist, thisadjust)
+
+
+def _decode_member(data, pos, end, lf):
+    _check_size(pos, 6, end)
+    fldattr = _parse_fldattr(data, pos, 2)
+    index, = _u32.unpack_from(data, pos + 2)
+    offset, name, pos = _value(data, pos + 6, end)
+    _, pos = _pad(data, pos, end)
+    return Member(lf, fldattr, index, name, offset), pos
+
+
+def _decode_enumerate(data, pos, end, lf):
+    _check_size(pos, 2, end)
+    fldattr = _parse_fldattr(data, pos, 2)
+    enum_value, name, pos = _value(data, pos + 2, end)
+    _, pos = _pad(data, pos, end)
+    return Enumerate(lf, fldattr, name, enum_value), pos
+
+
+def _decode_bclass(data, pos, end, lf):
+    _check_size(pos, 6, end)
+    fldattr = _parse_fldattr(data, pos, 2)
+    index, = _u32.unpack_from(data, pos + 2)
+    offset, name, pos = _value(data, pos + 6, end)
+    _, pos = _pad(data, pos, end)
+    return BaseClass(lf, fldattr, index, name, offset), pos
+
+
+def _decode_vfunctab(data, pos, end, lf):
+    _check_size(pos, 6, end)
+    vtype, = _u32.unpack_from(data, pos + 2)
+    _, pos = _pad(data, pos + 6, end)
+    return VFuncTab(lf, vtype), pos
+
+
+def _decode_onemethod(data, pos, end, lf):
+    _check_size(pos, 6, end)
+    fldattr = _parse_fldattr(data, pos, 2)
+    index, = _u32.unpack_from(data, pos + 2)
+    pos += 6
+    if fldattr.mprop in ("MTintro", "MTpureintro"):
+        _check_size(pos, 4, end)
+        val, = _u32.unpack_from(data, pos)
+        str_data, pos = _cstring(data, pos + 4, end)
+        intro = Container(val=val, str_data=str_data)
+    else:
+        intro, pos = _cstring(data, pos, end)
+    _, pos = _pad(data, pos, end)
+    return OneMethod(lf, fldattr, index, intro), pos
+
+
+def _decode_method(data, pos, end, lf):
+    _check_size(pos, 6, end)
+    count, mlist = struct.unpack_from("<HI", data, pos)
+    name, pos = _cstring(data, pos + 6, end)
+    _, pos = _pad(data, pos, end)
+    return Method(lf, count, mlist, name), pos
+
+
+def _decode_nesttype(data, pos, end, lf):
+    _check_size(pos, 6, end)
+    index, = _u32.unpack_from(data, pos + 2)
+    name, pos = _cstring(data, pos + 6, end)
+    # No PadAlign here, padding is parsed as the next member
+    return NestType(lf, index, name), pos
+
+
+_substruct_decoders = {
+    LEAF_TYPE_CODES["LF_MEMBER"]: _decode_member,
+    LEAF_TYPE_CODES["LF_ENUMERATE"]: _decode_enumerate,
+    LEAF_TYPE_CODES["LF_BCLASS"]: _decode_bclass,
+    LEAF_TYPE_CODES["LF_VFUNCTAB"]: _decode_vfunctab,
+    LEAF_TYPE_CODES["LF_ONEMETHOD"]: _decode_onemethod,
+    LEAF_TYPE_CODES["LF_METHOD"]: _decode_method,
+    LEAF_TYPE_CODES["LF_NESTTYPE"]: _decode_nesttype,
+}
+
+
+def _decode_fieldlist(data, pos, end, length, lf):
+    substructs = []
+    # Same as GreedyRange: members are parsed until one fails
+    while pos + 2 <= end:
+        code, = _u16.unpack_from(data, pos)
+        decoder = _substruct_decoders.get(code)
+        sub_leaf = leaf_type_name(code)
+        if decoder is None:
+            # Unknown member, nothing but its leaf type is parsed
+            substructs.append(UnknownMember(sub_leaf))
+            pos += 2
+            continue
+        try:
+            sub, pos = decoder(data, pos + 2, end, sub_leaf)
+        except (_ParseError, struct.error):
+            break
+        substructs.append(sub)
+    return FieldListType(length, lf, ListContainer(substructs))
+
+
+_type_decoders = {
+    LEAF_TYPE_CODES["LF_STRUCTURE"]: _decode_structure,
+    LEAF_TYPE_CODES["LF_CLASS"]: _decode_structure,
+    LEAF_TYPE_CODES["LF_UNION"]: _decode_union,
+    LEAF_TYPE_CODES["LF_ENUM"]: _decode_enum,
+    LEAF_TYPE_CODES["LF_FIELDLIST"]: _decode_fieldlist,
+    LEAF_TYPE_CODES["LF_POINTER"]: _decode_pointer,
+    LEAF_TYPE_CODES["LF_BITFIELD"]: _decode_bitfield,
+    LEAF_TYPE_CODES["LF_ARRAY"]: _decode_array,
+    LEAF_TYPE_CODES["LF_MODIFIER"]: _decode_modifier,
+    LEAF_TYPE_CODES["LF_PROCEDURE"]: _decode_procedure,
+    LEAF_TYPE_CODES["LF_MFUNCTION"]: _decode_mfunction,
+    LEAF_TYPE_CODES["LF_ARGLIST"]: _decode_arglist,
+}
+
+# Leaf types with a construct in Type, all others have no type_info
+_parsed_leaf_types = frozenset(Type.subcon.subcons[1].cases)
+
+
+def decode_type(data, pos, end, fast=True):
+    """Decode a single type record, without its length prefix.
+
+    data: bytes of the TPI stream
+    pos, end: offsets of the record in data
+
+    Returns a TypeRecord with the same fields as the Types construct would
+    parse after merge_subcon() and fix_value(), except for records that
+    the fast decoder doesn't handle: those are returned as a Container,
+    exactly as parsed by the construct.
+    """
+    length = end - pos
+    if end > len(data):
+        raise StreamError("stream read less than specified amount, expected %d, found %d" % (length, len(data) - pos))
+    if fast and length >= 2:
+        code, = _u16.unpack_from(data, pos)
+        decoder = _type_decoders.get(code)
+        lf = leaf_type_name(code)
+        if decoder is not None:
+            try:
+                return decoder(data, pos + 2, end, length, lf)
+            except (_Fallback, _ParseError, struct.error):
+                pass
+        elif lf not in _parsed_leaf_types:
+            return UnknownType(length, lf)
+    return Container(length=length, type_data=Type.parse(data[pos:end]))
+
+
+def decode_types(data, count, fast=True):
+    """Decode count consecutive length-prefixed type records from data."""
+    types = []
+    pos = 0
+    for _ in range(count):
+        length, = _u16.unpack_from(data, pos)
+        types.append(decode_type(data, pos + 2, pos + 2 + length, fast))
+        pos += 2 + length
+    return types
+
+
 # FIXME: this should not be necessary if we use the Embed construct
 def merge_subcon(parent, subattr):
     """Merge a subcon's fields into its parent.
@@ -1090,7 +1583,7 @@ def fix_value(leaf):
     """
     if not hasattr(leaf, 'value'):
         return
-    if leaf.value.value_or_type < leaf_type._encode("LF_CHAR", {}, None):
+    if leaf.value.value_or_type < LF_NUMERIC:
         setattr(leaf, 'name', leaf.value.name_or_val)
         setattr(leaf, leaf.value._value_name, leaf.value.value_or_type)
     else:
@@ -1100,153 +1593,392 @@ def fix_value(leaf):
     delattr(leaf, 'value')
 
 
-def resolve_typerefs(leaf, types, min, is_fieldlist):
-    """Resolve the numeric type references in a leaf node.
+def rename_2_7(lf):
+    if isinstance(lf.leaf_type, str) and lf.leaf_type.endswith("_ST"):
+        # The v7 name, with its code
+        lf.leaf_type = LEAF_TYPE_NAMES[LEAF_TYPE_CODES[lf.leaf_type[:-3]]]
 
-    For each reference to another type in the leaf node, look up the
-    corresponding type (base type or type defined in the TPI stream). The
-    dictionary type_refs is used to determine which fields in the leaf node
-    are references.
-    
-    leaf: the leaf node to convert
-    types: a dictionary of index->type mappings
-    min: the value of tpi_min; that is, the lowest type index in the stream
-    """
-    type_refs_dict = type_refs_fieldlist if is_fieldlist else type_refs
-
-    for attr in type_refs_dict.get(leaf.leaf_type, []):
-        ref = getattr(leaf, attr)
-        if isinstance(ref, list):
-            newrefs = []
-            for r in ref:
-                if r < min:
-                    newrefs.append(base_type._decode(r, {}, None))
-                else:
-                    newrefs.append(types[r])
-            newrefs = ListContainer(newrefs)
-            setattr(leaf, attr, newrefs)
-        else:
-            if ref < min:
-                setattr(leaf, attr, base_type._decode(ref, {}, None))
-            elif ref >= min:
-                try:
-                    setattr(leaf, attr, types[ref])
-                except KeyError:
-                    pass
-    return leaf
-
-
-def merge_fwdrefs(leaf, types, map, is_fieldlist):
-    type_refs_dict = type_refs_fieldlist if is_fieldlist else type_refs
-
-    for attr in type_refs_dict.get(leaf.leaf_type, []):
-        ref = getattr(leaf, attr)
-        if isinstance(ref, list):
-            newrefs = []
-            for r in ref:
-                try:
-                    newrefs.append(types[map[r.tpi_idx]])
-                except (KeyError, AttributeError):
-                    newrefs.append(r)
-            newrefs = ListContainer(newrefs)
-            setattr(leaf, attr, newrefs)
-        elif not isinstance(ref, str):
-            try:
-                newref = types[map[ref.tpi_idx]]
-            except (KeyError, AttributeError):
-                newref = ref
-            setattr(leaf, attr, newref)
-    return leaf
 
+def normalize_type(t, idx):
+    """Flatten a freshly decoded type and its members (see merge_subcon()
+    and fix_value()), and record its type index.
 
-def rename_2_7(lf):
-    if isinstance(lf.leaf_type, str) and lf.leaf_type.endswith("_ST"):
-        lf.leaf_type = lf.leaf_type[:-3]
+    t: the type, as returned by decode_type()
+    idx: its type index
+    """
+    t.tpi_idx = idx
+    if isinstance(t, TypeRecord):
+        # Flat already
+        return t
+    merge_subcon(t, 'type_data')
+    merge_subcon(t, 'type_info')
+    if t.leaf_type == 'LF_FIELDLIST':
+        for s in t.substructs:
+            merge_subcon(s, 'type_info')
+            fix_value(s)
+    else:
+        fix_value(t)
+    return t
 
 
-def parse_stream(fp, unnamed_hack = True, elim_fwdrefs = True):
-    """Parse a TPI stream.
+_unnamed_names = frozenset(["__unnamed", "<unnamed-tag>", "<anonymous-tag>"])
 
-    fp: a file-like object that holds the type data to be parsed. Must
-        support seeking.
 
+def resolve_type(t, resolve, unnamed_hack = True):
+    """Resolve the numeric type references of a normalized type.
+
+    For each reference to another type in the type or its fieldlist
+    members (see type_refs and type_refs_fieldlist), the reference is
+    replaced with resolve(ref). Leaf names are then standardized to the v7
+    convention and, with unnamed_hack, unnamed types get a unique name.
     """
-    tpi_stream = TPIStream.parse_stream(fp)
-
-    # Postprocessing
-    # 1. Index the types
-    tpi_stream.types = dict(
-        (i, t) for (i, t) in zip(range(tpi_stream.TPIHeader.ti_min, tpi_stream.TPIHeader.ti_max), tpi_stream.types))
-    for k in tpi_stream.types:
-        tpi_stream.types[k].tpi_idx = k
-
-    # 2. Flatten type_info and type_data
-    for t in tpi_stream.types.values():
-        merge_subcon(t, 'type_data')
-        merge_subcon(t, 'type_info')
-        if t.leaf_type == 'LF_FIELDLIST':
-            for s in t.substructs:
-                merge_subcon(s, 'type_info')
-
-    # 3. Fix up value and name structures
-    for t in tpi_stream.types.values():
-        if t.leaf_type == 'LF_FIELDLIST':
-            for s in t.substructs:
-                fix_value(s)
-        else:
-            fix_value(t)
-
-    # 4. Resolve type references
-    types = tpi_stream.types
-    min = tpi_stream.TPIHeader.ti_min
-    for i in types:
-        if types[i].leaf_type == "LF_FIELDLIST":
-            types[i].substructs = ListContainer([resolve_typerefs(t, types, min, True) for t in types[i].substructs])
-        else:
-            types[i] = resolve_typerefs(types[i], types, min, False)
+    if t.leaf_type == "LF_FIELDLIST":
+        members = [(s, type_refs_fieldlist) for s in t.substructs]
+    else:
+        members = [(t, type_refs)]
+    for member, refs in members:
+        for attr in refs.get(member.leaf_type, ()):
+            ref = getattr(member, attr)
+            if isinstance(ref, list):
+                setattr(member, attr, ListContainer([resolve(r) for r in ref]))
+            else:
+                setattr(member, attr, resolve(ref))
+        rename_2_7(member)
+    if unnamed_hack and getattr(t, 'name', None) in _unnamed_names:
+        t.name = ("__unnamed_%x" % t.tpi_idx)
+    return t
 
-    # 5. Standardize v2 leaf names to v7 convention
-    for i in types:
-        rename_2_7(types[i])
-        if types[i].leaf_type == "LF_FIELDLIST":
-            for s in types[i].substructs:
-                rename_2_7(s)
 
-    # 6. Attempt to eliminate forward refs
+def process_types(types, ti_min, unnamed_hack = True, elim_fwdrefs = True):
+    """Post-process the decoded types of a TPI stream.
+
+    types: the types, as returned by decode_types()
+    ti_min: the type index of the first type
+
+    Returns a dictionary of index->type mappings. The types are processed in
+    two passes: the first one normalizes each type and collects names of
+    forward references and their definitions, the second one resolves type
+    references, pointing forward references to the definitions right away.
+    """
+    types = dict(zip(range(ti_min, ti_min + len(types)), types))
+
     # Not possible to eliminate all fwdrefs; some may not be in
     # this PDB file (eg _UNICODE_STRING in ntoskrnl.pdb)
-    if elim_fwdrefs:
-        # Get list of fwdrefs
-        fwdrefs = {}
-        for i in types:
-            if hasattr(types[i], 'prop') and types[i].prop.fwdref:
-                fwdrefs[types[i].name] = i
-        # Map them to the real type
-        fwdref_map = {}
-        for i in types:
-            if (hasattr(types[i], 'name') and hasattr(types[i], 'prop') and not types[i].prop.fwdref):
-                if types[i].name in fwdrefs:
-                    fwdref_map[fwdrefs[types[i].name]] = types[i].tpi_idx
-        # Change any references to the fwdref to point to the real type
-        for i in types:
-            if types[i].leaf_type == "LF_FIELDLIST":
-                types[i].substructs = ListContainer([merge_fwdrefs(t, types, fwdref_map, True) for t in types[i].substructs])
+    fwdrefs = {}
+    definitions = {}
+    for idx, t in types.items():
+        normalize_type(t, idx)
+        if elim_fwdrefs and hasattr(t, 'prop'):
+            if t.prop.fwdref:
+                fwdrefs[t.name] = idx
             else:
-                types[i] = merge_fwdrefs(types[i], types, fwdref_map, False)
-        # Get rid of the resolved fwdrefs
-        for i in fwdref_map:
-            del types[i]
+                definitions[t.name] = idx
+    # The last fwdref of a name is mapped to the last definition of it
+    fwdref_map = dict((fwdrefs[name], definitions[name]) for name in fwdrefs if name in definitions)
+
+    def resolve(ref):
+        if ref < ti_min:
+            return base_type_name(ref)
+        try:
+            return types[fwdref_map.get(ref, ref)]
+        except KeyError:
+            return ref
+
+    for t in types.values():
+        resolve_type(t, resolve, unnamed_hack)
+    # Get rid of the resolved fwdrefs
+    for idx in fwdref_map:
+        del types[idx]
+    return types
+
+
+def record_offsets(data, count):
+    """Find where each of count consecutive length-prefixed records of data
+    starts, reading only the length prefixes."""
+    offsets = array('I', bytes(4 * count))
+    unpack_length = _u16.unpack_from
+    pos = 0
+    for i in range(count):
+        offsets[i] = pos
+        pos += 2 + unpack_length(data, pos)[0]
+    return offsets
+
+
+# Leaf types with the "prop" field, the only candidates for fwdref elimination
+_udt_leaf_types = frozenset(LEAF_TYPE_CODES[lf] for lf in (
+    "LF_CLASS", "LF_STRUCTURE", "LF_STRUCTURE_ST", "LF_UNION", "LF_UNION_ST", "LF_ENUM"))
+
+# Offset of the name (or the size preceding it) in the v7 UDT records
+_udt_name_offsets = {
+    LEAF_TYPE_CODES["LF_CLASS"]: 18,
+    LEAF_TYPE_CODES["LF_STRUCTURE"]: 18,
+    LEAF_TYPE_CODES["LF_UNION"]: 10,
+    LEAF_TYPE_CODES["LF_ENUM"]: 14,
+}
+
+
+class LazyTypes(collections.abc.Mapping):
+    """Types of a TPI stream, decoded on first access.
 
-    if unnamed_hack:
-        for i in types:
-            if (hasattr(types[i], 'name') and types[i].name in ["__unnamed", "<unnamed-tag>", "<anonymous-tag>"]):
-                types[i].name = ("__unnamed_%x" % types[i].tpi_idx)
+    Only the length prefixes of the records are read up front, to know
+    where each record starts. A type is decoded when it is looked up by its
+    type index, together with all types it references, and post-processed
+    the same way as process_types() does it for all types at once.
+
+    Forward references are eliminated as in process_types(), which needs the
+    names of all structures, unions and enums. These are read (without
+    decoding the rest of the records) on the first access to a forward
+    reference.
+
+    With the contents of the TPI hash stream (hash_data, as described by the
+    TPIHash header in hash_info), find_type() looks up a type by name
+    without going through all records.
+    """
+
+    def __init__(self, data, ti_min, ti_max, unnamed_hack=True, elim_fwdrefs=True, fast=True, hash_info=None,
+                 hash_data=None):
+        self.data = data
+        self.ti_min = ti_min
+        self.ti_max = ti_max
+        self.unnamed_hack = unnamed_hack
+        self.elim_fwdrefs = elim_fwdrefs
+        self.fast = fast
+        self.hash_info = hash_info
+        self.hash_data = hash_data
+        self._offsets = None
+        self._ti_offsets = None
+        self._buckets = None
+        self._types = {}
+        self._fwdref_map = None
+        self._definitions = None
+        self._lock = threading.RLock()
+
+    def __getitem__(self, idx):
+        if not self.ti_min <= idx < self.ti_max or self._eliminated(idx):
+            raise KeyError(idx)
+        with self._lock:
+            try:
+                return self._types[idx]
+            except KeyError:
+                return self._load(idx)
+
+    def __contains__(self, idx):
+        return self.ti_min <= idx < self.ti_max and not self._eliminated(idx)
+
+    def __iter__(self):
+        fwdref_map = self.fwdref_map if self.elim_fwdrefs else {}
+        return (i for i in range(self.ti_min, self.ti_max) if i not in fwdref_map)
+
+    def __len__(self):
+        return self.ti_max - self.ti_min - (len(self.fwdref_map) if self.elim_fwdrefs else 0)
+
+    @property
+    def offsets(self):
+        """Offsets of all records in data"""
+        with self._lock:
+            if self._offsets is None:
+                self._offsets = record_offsets(self.data, self.ti_max - self.ti_min)
+            return self._offsets
+
+    @property
+    def fwdref_map(self):
+        """Type index of a forward reference -> type index of its definition"""
+        with self._lock:
+            if self._fwdref_map is None:
+                self._scan_udts()
+            return self._fwdref_map
+
+    @property
+    def definitions(self):
+        """Name -> type index of the (last) definition of a structure, union
+        or enum"""
+        with self._lock:
+            if self._definitions is None:
+                self._scan_udts()
+            return self._definitions
+
+    def find_type(self, name):
+        """Find the definition of a structure, union or enum by name.
+
+        Only the records in the hash bucket of the name are looked at, all
+        names are read only if the hash table is missing or doesn't have it
+        (e.g. nested types are hashed by their unique, decorated name).
+        Returns None if there's no such type.
+        """
+        idx = None
+        buckets = self._hash_buckets()
+        if buckets is not None:
+            bucket = hash_string_v1(name) % self.hash_info.Buckets
+            for i in buckets.get(bucket, ()):
+                udt = self._udt_info(i)
+                if udt is not None and not udt[0] and udt[1] == name:
+                    idx = i
+        if idx is None:
+            idx = self.definitions.get(name)
+        return None if idx is None else self[idx]
+
+    def _hash_buckets(self):
+        """Hash bucket -> type indices, from the HashVals table"""
+        with self._lock:
+            if self._buckets is None and self.hash_data is not None:
+                self._buckets = {}
+                hash_vals = self.hash_info.HashVals
+                typecode = {2: 'H', 4: 'I'}.get(self.hash_info.HashKey)
+                count = self.ti_max - self.ti_min
+                if typecode is None or hash_vals.cb != count * self.hash_info.HashKey:
+                    self.hash_data = None
+                    self._buckets = None
+                    return None
+                values = array(typecode, bytes(self.hash_data[hash_vals.off:hash_vals.off + hash_vals.cb]))
+                for idx, bucket in enumerate(values, self.ti_min):
+                    self._buckets.setdefault(bucket, []).append(idx)
+            return self._buckets
+
+    def _offset(self, idx):
+        """Offset of a single record. Unless offsets of all records are known
+        already, walks the records from the nearest TiOff entry, so that
+        a few records can be looked at without reading all length prefixes.
+        """
+        if self._offsets is not None or self.hash_data is None:
+            return self.offsets[idx - self.ti_min]
+        with self._lock:
+            if self._ti_offsets is None:
+                ti_off = self.hash_info.TiOff
+                raw = bytes(self.hash_data[ti_off.off:ti_off.off + ti_off.cb])
+                pairs = struct.unpack("<%dI" % (len(raw) // 4), raw[:len(raw) // 8 * 8])
+                self._ti_offsets = (pairs[0::2], pairs[1::2])
+        tis, offs = self._ti_offsets
+        i = bisect_right(tis, idx) - 1
+        if i < 0:
+            ti, pos = self.ti_min, 0
+        else:
+            ti, pos = tis[i], offs[i]
+        unpack_length = _u16.unpack_from
+        for _ in range(idx - ti):
+            pos += 2 + unpack_length(self.data, pos)[0]
+        return pos
+
+    def _eliminated(self, idx):
+        if not self.elim_fwdrefs:
+            return False
+        if self._fwdref_map is not None:
+            return idx in self._fwdref_map
+        # Only forward references may be eliminated, no need to read all
+        # names to tell that other types are not
+        udt = self._udt_info(idx)
+        return udt is not None and udt[0] and idx in self.fwdref_map
+
+    def _udt_info(self, idx):
+        """Returns (fwdref, name) of a structure, union or enum, None for
+        other types."""
+        data = self.data
+        pos = self._offset(idx)
+        length, leaf = struct.unpack_from("<HH", data, pos)
+        if leaf not in _udt_leaf_types:
+            return None
+        end = pos + 2 + length
+        name_offset = _udt_name_offsets.get(leaf)
+        if name_offset is not None:
+            try:
+                fwdref = _parse_property(data, pos + 6, 2).fwdref
+                if leaf == LEAF_TYPE_CODES["LF_ENUM"]:
+                    name, _ = _cstring(data, pos + 2 + name_offset, end)
+                else:
+                    _, name, _ = _value(data, pos + 2 + name_offset, end)
+                return fwdref, name
+            except (_Fallback, _ParseError, struct.error):
+                pass
+        t = self._decode(idx)
+        return t.prop.fwdref, t.name
+
+    def _scan_udts(self):
+        # Same as in process_types(): the last forward reference of a name is
+        # mapped to the last definition of that name
+        fwdrefs = {}
+        definitions = {}
+        # All records are looked at, so read all length prefixes at once
+        self.offsets
+        for idx in range(self.ti_min, self.ti_max):
+            udt = self._udt_info(idx)
+            if udt is not None:
+                fwdref, name = udt
+                if fwdref:
+                    fwdrefs[name] = idx
+                else:
+                    definitions[name] = idx
+        self._definitions = definitions
+        self._fwdref_map = dict((fwdrefs[name], definitions[name]) for name in fwdrefs if name in definitions)
+
+    def _decode(self, idx):
+        """Decode a single type, without resolving its references."""
+        data = self.data
+        pos = self.offsets[idx - self.ti_min]
+        length, = _u16.unpack_from(data, pos)
+        return normalize_type(decode_type(data, pos + 2, pos + 2 + length, self.fast), idx)
+
+    def _load(self, idx):
+        """Decode a type and all types it references, directly or not."""
+        pending = []
+        created = []
+        types = self._types
+
+        def get(i):
+            try:
+                return types[i]
+            except KeyError:
+                t = types[i] = self._decode(i)
+                pending.append(t)
+                created.append(i)
+                return t
+
+        def resolve(ref):
+            if ref < self.ti_min:
+                return base_type_name(ref)
+            if ref >= self.ti_max:
+                return ref
+            t = get(ref)
+            if self.elim_fwdrefs and hasattr(t, 'prop') and t.prop.fwdref and ref in self.fwdref_map:
+                t = get(self.fwdref_map[ref])
+            return t
+
+        try:
+            t = get(idx)
+            while pending:
+                resolve_type(pending.pop(), resolve, self.unnamed_hack)
+        except Exception:
+            # Don't leave half-resolved types behind
+            for i in created:
+                del types[i]
+            raise
+        return t
+
+
+def parse_stream(fp, unnamed_hack = True, elim_fwdrefs = True, fast = True, lazy = False):
+    """Parse a TPI stream.
+
+    fp: a file-like object that holds the type data to be parsed. Must
+        support seeking.
+    fast: decode common leaf types with the fast decoder instead of
+        the Type construct
+    lazy: return the types as a LazyTypes mapping, decoding each type
+        on first access
+
+    """
+    header = Header.parse_stream(fp)
+    if lazy:
+        return Container(
+            TPIHeader = header,
+            types = LazyTypes(bytes(fp.read()), header.ti_min, header.ti_max, unnamed_hack, elim_fwdrefs, fast,
+                              header.TPIHash))
 
-    return tpi_stream
+    types = decode_types(bytes(fp.read()), header.ti_max - header.ti_min, fast)
+    return Container(
+        TPIHeader = header,
+        types = process_types(types, header.ti_min, unnamed_hack, elim_fwdrefs))
 
 
-def parse(data, unnamed_hack = True, elim_fwdrefs = True):
-    return parse_stream(BytesIO(data), unnamed_hack, elim_fwdrefs)
+def parse(data, unnamed_hack = True, elim_fwdrefs = True, fast = True, lazy = False):
+    return parse_stream(BytesIO(data), unnamed_hack, elim_fwdrefs, fast, lazy)
 
 
 if __name__ == "__main__":
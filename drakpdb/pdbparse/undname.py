@@ -29,3 +29,12 @@ def undname(name, flags = UNDNAME_NAME_ONLY):
         name = name.rsplit('@', 1)[0][1:]
 
     return name
+
+
+def undname_many(names, flags = UNDNAME_NAME_ONLY):
+    """Undecorate a list of mangled C++ names at once. Returns the list of
+    unmangled names, with None for the ones that can not be undecorated.
+
+    The GIL is released while the names are undecorated, so lists of
+    names can be undecorated in many threads at once."""
+    return _undname.undname_many(list(names), flags)
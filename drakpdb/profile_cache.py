@@ -0,0 +1,126 @@
+import hashlib
+import importlib.metadata
+import json
+import os
+
+from .profile_writer import atomic_file, write_profile
+
+CACHE_VERSION = 1
+# Default limit of the total size of cached profiles
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+
+def _drakpdb_version():
+    try:
+        return importlib.metadata.version("drakpdb")
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    # Not installed, e.g. run from a source checkout: profiles of different
+    # sources mustn't be mixed up
+    digest = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith((".py", ".c", ".h")):
+                with open(os.path.join(root, filename), "rb") as f:
+                    digest.update(f.read())
+    return "source-" + digest.hexdigest()
+
+
+class ProfileCache:
+    """
+    Directory of generated profiles, stored under a key made of the PDB
+    GUID/Age, the drakpdb version and the options the profile was made
+    with.
+
+    Profiles are written to a temporary file and renamed, so concurrent
+    readers never see a partially written one. When cached profiles take
+    more than `max_size` bytes, the least recently used ones are removed.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, pdb_symstore_hash, **options):
+        """
+        Returns cache key of the profile of PDB with `pdb_symstore_hash`,
+        generated with `options` (JSON-serializable values)
+        """
+        description = json.dumps(
+            {
+                "cache": CACHE_VERSION,
+                "drakpdb": _drakpdb_version(),
+                "pdb": pdb_symstore_hash,
+                "options": options,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        Returns the profile stored under `key`, or None if there is none
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                profile = json.loads(f.read())
+            if not isinstance(profile, dict):
+                raise ValueError("Cached profile is not an object")
+            # Modification time tells when the profile was last used
+            os.utime(path)
+        except FileNotFoundError:
+            # Not cached, or evicted in the meantime
+            return None
+        except ValueError:
+            # Corrupt entry, the profile will be generated and stored again
+            self._remove(path)
+            return None
+        return profile
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Removed by another process
+            pass
+
+    def put(self, key, profile):
+        """
+        Stores `profile` under `key` and evicts least recently used profiles
+        if the cache got too big
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_file(self._path(key)) as f:
+            write_profile(iter(profile.items()), f, indent=None)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used profiles until the cached ones take at
+        most `max_size` bytes
+        """
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            self._remove(path)
+            total_size -= size
@@ -0,0 +1,161 @@
+import collections.abc
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Buffer size of profile files written with write_profile_file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Temporary files get the permissions open() would give them
+_UMASK = _get_umask()
+
+
+def _json_encoder(indent):
+    if indent is None:
+
+        def encode(value):
+            return json.dumps(value, separators=(",", ":")).encode()
+
+    else:
+
+        def encode(value):
+            return json.dumps(value, indent=indent).encode()
+
+    return encode
+
+
+def _orjson_encoder(indent):
+    if indent is not None:
+        raise ValueError("orjson backend can only write compact profiles")
+    return orjson.dumps
+
+
+# Name -> function returning value -> bytes encoder for given indent
+ENCODER_BACKENDS = {"json": _json_encoder}
+if orjson is not None:
+    ENCODER_BACKENDS["orjson"] = _orjson_encoder
+
+
+def default_backend(indent):
+    """
+    Returns the fastest encoder backend able to write profiles with `indent`
+    """
+    if indent is None and "orjson" in ENCODER_BACKENDS:
+        return "orjson"
+    return "json"
+
+
+class _CountingWriter:
+    def __init__(self, fp):
+        self.fp = fp
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        self.fp.write(data)
+
+
+def _newline(indent, level):
+    if indent is None:
+        return b""
+    return b"\n" + b" " * (indent * level)
+
+
+def _write_object(fp, entries, indent, level, encode, write_value):
+    """
+    Writes a JSON object made of (name, value) pairs, one pair at a time.
+    `write_value(value, level)` writes a value nested at `level`.
+    """
+    key_separator = b":" if indent is None else b": "
+    separator = b"{" + _newline(indent, level + 1)
+    for name, value in entries:
+        fp.write(separator)
+        fp.write(encode(name))
+        fp.write(key_separator)
+        write_value(value, level + 1)
+        separator = b"," + _newline(indent, level + 1)
+    if separator[0:1] == b"{":
+        # No entries at all
+        fp.write(b"{}")
+    else:
+        fp.write(_newline(indent, level) + b"}")
+
+
+def write_profile(sections, fp, indent=4, backend=None):
+    """
+    Writes profile sections, as yielded by `iter_pdb_profile`, to binary
+    file `fp`. Sections given as iterators are written entry by entry, so
+    only one entry is kept in memory at a time.
+
+    With the "json" backend, the output is the same as of `json.dumps` of
+    the whole profile with `indent`, or with minimal separators if `indent`
+    is None. "orjson" is faster, but writes only compact profiles and
+    doesn't escape non-ASCII characters. By default the fastest available
+    backend is used. Returns the number of bytes written.
+    """
+    if backend is None:
+        backend = default_backend(indent)
+    encode = ENCODER_BACKENDS[backend](indent)
+    out = _CountingWriter(fp)
+
+    def write_value(value, level):
+        # Strings are encoded with escaped newlines, so all newlines come
+        # from the indentation
+        if indent is None:
+            out.write(encode(value))
+        else:
+            out.write(encode(value).replace(b"\n", _newline(indent, level)))
+
+    def write_section(entries, level):
+        if isinstance(entries, collections.abc.Iterator):
+            _write_object(out, entries, indent, level, encode, write_value)
+        else:
+            write_value(entries, level)
+
+    _write_object(out, sections, indent, 0, encode, write_section)
+    return out.written
+
+
+@contextlib.contextmanager
+def atomic_file(path, mode="wb", buffering=-1):
+    """
+    Opens a uniquely named temporary file next to `path`, which replaces
+    `path` once the block exits and is removed if it raises. `path` never
+    holds a partially written file, even with many concurrent writers.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=name + ".", dir=directory)
+    try:
+        with os.fdopen(fd, mode, buffering) as f:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_profile_file(sections, path, indent=4, backend=None):
+    """
+    Writes profile sections to file under `path` (see `write_profile`).
+    The profile is written to a temporary file first and renamed at the
+    end, so `path` never holds a partially written profile.
+    """
+    with atomic_file(path, "wb", WRITE_BUFFER_SIZE) as f:
+        return write_profile(sections, f, indent, backend)
@@ -1,5 +1,12 @@
+import hashlib
+import json
+import re
+import threading
+
 from construct import EnumIntegerString
 
+from .pdbparse import tpi
+
 # Derived from rekall
 TYPE_ENUM_TO_VTYPE = {
     "T_32PINT4": ["Pointer", dict(target="long")],
@@ -53,84 +60,494 @@ TYPE_ENUM_TO_VTYPE = {
     "T_VOID": ["Void", {}],
     "T_WCHAR": ["UnicodeString", {}],
     "T_HRESULT": ["long", {}],
+    "T_CHAR16": ["unsigned short", {}],
+    "T_CHAR32": ["unsigned int", {}],
+    "T_32PCHAR16": ["Pointer", dict(target="unsigned short")],
+    "T_32PCHAR32": ["Pointer", dict(target="unsigned int")],
+    "T_64PCHAR16": ["Pointer", dict(target="unsigned short")],
+    "T_64PCHAR32": ["Pointer", dict(target="unsigned int")],
+}
+
+# TYPE_ENUM_TO_VTYPE keyed by base type code
+BASE_TYPE_VTYPES = {
+    tpi.base_types[name]: vtype for name, vtype in TYPE_ENUM_TO_VTYPE.items()
 }
 
 
-def process_structure_reference(member):
-    return [member.name, {}]
+# Sizes of types in TYPE_ENUM_TO_VTYPE that are not pointers
+VTYPE_SIZES = {
+    "Void": 0,
+    "char": 1,
+    "unsigned char": 1,
+    "short": 2,
+    "unsigned short": 2,
+    "long": 4,
+    "unsigned long": 4,
+    "unsigned int": 4,
+    "long long": 8,
+    "unsigned long long": 8,
+    "float": 4,
+    "double": 8,
+    "long double": 10,
+    "UnicodeString": 2,
+}
 
+# Sizes of base types keyed by base type code
+BASE_TYPE_SIZES = {
+    tpi.base_types[name]: (
+        4
+        if name.startswith("T_32P")
+        else 8 if name.startswith("T_64P") else VTYPE_SIZES[vtype[0]]
+    )
+    for name, vtype in TYPE_ENUM_TO_VTYPE.items()
+}
 
-def process_pointer(member):
-    return ["Pointer", {**process_base_type_info(member.utype)}]
+UNKNOWN_VTYPE = ["<unknown>", {}]
 
+# Codes of the leaf types handled here, leaf types are compared by code
+LF_POINTER = tpi.LEAF_TYPE_CODES["LF_POINTER"]
+LF_BITFIELD = tpi.LEAF_TYPE_CODES["LF_BITFIELD"]
+LF_ARRAY = tpi.LEAF_TYPE_CODES["LF_ARRAY"]
+LF_MODIFIER = tpi.LEAF_TYPE_CODES["LF_MODIFIER"]
+LF_ENUM = tpi.LEAF_TYPE_CODES["LF_ENUM"]
+LF_STRUCTURE = tpi.LEAF_TYPE_CODES["LF_STRUCTURE"]
+LF_UNION = tpi.LEAF_TYPE_CODES["LF_UNION"]
+LF_PROCEDURE = tpi.LEAF_TYPE_CODES["LF_PROCEDURE"]
+LF_MFUNCTION = tpi.LEAF_TYPE_CODES["LF_MFUNCTION"]
+LF_MEMBER = tpi.LEAF_TYPE_CODES["LF_MEMBER"]
 
-def process_bitfield(member):
-    return [
-        "BitField",
-        {
-            "start_bit": member.position,
-            "end_bit": member.position + member.length,
-            **process_base_type_info(member.base_type),
-        },
-    ]
+STRUCTURE_LEAF_TYPES = (LF_STRUCTURE, LF_UNION)
 
+# Attribute through which a type wraps another one, for types converted
+# into a descriptor of the wrapped type
+WRAPPED_TYPE_ATTRS = {
+    LF_POINTER: "utype",
+    LF_BITFIELD: "base_type",
+    LF_ARRAY: "element_type",
+    LF_MODIFIER: "modified_type",
+    LF_ENUM: "utype",
+}
+
+
+def leaf_code(record):
+    """
+    Returns the leaf type code of a type or fieldlist member, None for base
+    types and anything else without a leaf type
+    """
+    leaf_type = getattr(record, "leaf_type", None)
+    if leaf_type is None:
+        return None
+    return int(leaf_type)
 
-def process_base_type_info(node):
-    target, target_args = process_member_type(node)
+
+def type_size(member_type):
+    """
+    Returns the size of a value of `member_type` type, 0 if it's unknown
+    """
+    while True:
+        if isinstance(member_type, EnumIntegerString):
+            return BASE_TYPE_SIZES.get(member_type.intvalue, 0)
+        code = leaf_code(member_type)
+        if code in (LF_STRUCTURE, LF_UNION, LF_ARRAY):
+            return member_type.size
+        if code == LF_POINTER:
+            return 8 if member_type.ptr_attr.type == "PTR_64" else 4
+        if code == LF_MODIFIER:
+            member_type = member_type.modified_type
+        elif code == LF_ENUM:
+            member_type = member_type.utype
+        else:
+            return 0
+
+
+def array_count(array):
+    element_size = type_size(array.element_type)
+    if not element_size:
+        return 0
+    return array.size // element_size
+
+
+def target_info(descriptor):
+    target, target_args = descriptor
     if not target_args:
         return {"target": target}
     else:
         return {"target": target, "target_args": target_args}
 
 
-def process_member_type(member_type):
-    if isinstance(member_type, EnumIntegerString):
-        return TYPE_ENUM_TO_VTYPE.get(member_type, "<unknown>")
-    # TODO: Right now we don't handle LF_ARRAY, LF_ENUM,
-    #       nested unnamed struct/unions etc
-    complex_leaf_types = {
-        "LF_STRUCTURE": process_structure_reference,
-        "LF_UNION": process_structure_reference,
-        "LF_BITFIELD": process_bitfield,
-        "LF_POINTER": process_pointer,
-    }
-    if (
-        not hasattr(member_type, "leaf_type")
-        or member_type.leaf_type not in complex_leaf_types
-    ):
-        return ["<unknown>", {}]
-    return complex_leaf_types[member_type.leaf_type](member_type)
+class TypeConverter:
+    """
+    Converts member types of one TPI stream into Rekall-like descriptors.
 
+    Types are converted once and memoized by their index in the stream.
+    Pointer, bitfield, array, modifier and enum chains are walked without
+    recursion. Types converted into identical descriptors share a single
+    descriptor, so the descriptors must not be modified.
+    """
+
+    def __init__(self):
+        # tpi_idx -> (key, descriptor)
+        self._by_index = {}
+        # key -> descriptor
+        self._shared = {}
+
+    def _share(self, key, descriptor):
+        return self._shared.setdefault(key, descriptor)
+
+    def _leaf(self, member_type):
+        if isinstance(member_type, EnumIntegerString):
+            code = member_type.intvalue
+            return ("base", code), BASE_TYPE_VTYPES.get(code, UNKNOWN_VTYPE)
+        code = leaf_code(member_type)
+        if code in STRUCTURE_LEAF_TYPES:
+            key = ("struct", member_type.name)
+            return key, self._share(key, [member_type.name, {}])
+        if code in (LF_PROCEDURE, LF_MFUNCTION):
+            return ("function",), self._share(("function",), ["Function", {}])
+        return ("unknown",), UNKNOWN_VTYPE
+
+    def _wrap(self, member_type, inner_key, inner):
+        code = leaf_code(member_type)
+        if code == LF_MODIFIER:
+            # const/volatile don't change how the member is read
+            return inner_key, inner
+        if code == LF_POINTER:
+            key = ("pointer", inner_key)
+            if key in self._shared:
+                return key, self._shared[key]
+            return key, self._share(key, ["Pointer", target_info(inner)])
+        if code == LF_BITFIELD:
+            start_bit = member_type.position
+            end_bit = start_bit + member_type.length
+            key = ("bitfield", start_bit, end_bit, inner_key)
+            if key in self._shared:
+                return key, self._shared[key]
+            args = {"start_bit": start_bit, "end_bit": end_bit, **target_info(inner)}
+            return key, self._share(key, ["BitField", args])
+        if code == LF_ARRAY:
+            count = array_count(member_type)
+            key = ("array", count, inner_key)
+            if key in self._shared:
+                return key, self._shared[key]
+            return key, self._share(
+                key, ["Array", {"count": count, **target_info(inner)}]
+            )
+        # LF_ENUM
+        key = ("enum", member_type.name, inner_key)
+        if key in self._shared:
+            return key, self._shared[key]
+        args = {"enum_name": member_type.name, **target_info(inner)}
+        return key, self._share(key, ["Enumeration", args])
+
+    def member_type(self, member_type):
+        """
+        Returns [target, target_args] descriptor of `member_type`
+        """
+        chain = []
+        while True:
+            tpi_idx = getattr(member_type, "tpi_idx", None)
+            if tpi_idx is not None and tpi_idx in self._by_index:
+                key, descriptor = self._by_index[tpi_idx]
+                break
+            attr = WRAPPED_TYPE_ATTRS.get(leaf_code(member_type))
+            if attr is None:
+                key, descriptor = self._leaf(member_type)
+                if tpi_idx is not None:
+                    self._by_index[tpi_idx] = (key, descriptor)
+                break
+            chain.append(member_type)
+            member_type = getattr(member_type, attr)
+        for member_type in reversed(chain):
+            key, descriptor = self._wrap(member_type, key, descriptor)
+            tpi_idx = getattr(member_type, "tpi_idx", None)
+            if tpi_idx is not None:
+                self._by_index[tpi_idx] = (key, descriptor)
+        return descriptor
 
-def process_structure_member(member):
-    return process_member_type(member.index)
+    def structure(self, struct):
+        """
+        Returns [size, {member name: [offset, descriptor]}] of `struct`
+        """
+        if leaf_code(struct) not in STRUCTURE_LEAF_TYPES:
+            # Unhandled type of structure
+            return [0, {}]
+        if not hasattr(struct.fieldlist, "substructs"):
+            # Usually T_NOTYPE
+            return [0, {}]
+        return [
+            struct.size,
+            {
+                member.name: [member.offset, self.member_type(member.index)]
+                for member in struct.fieldlist.substructs
+                if leaf_code(member) == LF_MEMBER
+            },
+        ]
+
+
+def process_member_type(member_type):
+    return TypeConverter().member_type(member_type)
 
 
 def process_structure(struct):
-    if struct.leaf_type not in ["LF_STRUCTURE", "LF_UNION"]:
-        # Unhandled type of structure
-        return [0, {}]
+    return TypeConverter().structure(struct)
+
+
+def member_structure(member_type):
+    """
+    Returns the structure or union a member of `member_type` type refers
+    to (e.g. through a pointer or an array), None if there is none
+    """
+    while hasattr(member_type, "leaf_type"):
+        code = leaf_code(member_type)
+        if code in STRUCTURE_LEAF_TYPES:
+            return member_type
+        attr = WRAPPED_TYPE_ATTRS.get(code)
+        if attr is None:
+            return None
+        member_type = getattr(member_type, attr)
+    return None
+
+
+def member_type_key(member_type):
+    """
+    Returns a hashable description of a member type, made of everything
+    its converted form depends on. Structures are described by name.
+    """
+    chain = []
+    while hasattr(member_type, "leaf_type"):
+        # Keys hold leaf type names, so that layout hashes don't change
+        leaf_type = member_type.leaf_type
+        code = int(leaf_type)
+        if code == LF_POINTER:
+            chain.append((leaf_type,))
+            member_type = member_type.utype
+        elif code == LF_BITFIELD:
+            chain.append((leaf_type, member_type.position, member_type.length))
+            member_type = member_type.base_type
+        elif code == LF_ARRAY:
+            chain.append((leaf_type, member_type.size, array_count(member_type)))
+            member_type = member_type.element_type
+        elif code == LF_MODIFIER:
+            modifier = member_type.modifier
+            chain.append(
+                (leaf_type, modifier.const, modifier.volatile, modifier.unaligned)
+            )
+            member_type = member_type.modified_type
+        elif code == LF_ENUM:
+            chain.append((leaf_type, member_type.name))
+            member_type = member_type.utype
+        else:
+            member_type = (leaf_type, getattr(member_type, "name", None))
+            break
+    key = member_type
+    for link in reversed(chain):
+        key = link + (key,)
+    return key
+
+
+def structure_key(struct):
+    """
+    Returns a hashable description of the structure layout: its name, size
+    and the name, offset and type of each member. None for types that are
+    not (complete) structures or unions.
+    """
+    if leaf_code(struct) not in STRUCTURE_LEAF_TYPES:
+        return None
     if not hasattr(struct.fieldlist, "substructs"):
-        # Usually T_NOTYPE
-        return [0, {}]
-    return [
+        return None
+    return (
+        struct.leaf_type,
+        struct.name,
         struct.size,
-        {
-            member.name: [member.offset, process_structure_member(member)]
+        tuple(
+            (member.name, member.offset, member_type_key(member.index))
             for member in struct.fieldlist.substructs
-            if member.leaf_type == "LF_MEMBER"
-        },
-    ]
+            if leaf_code(member) == LF_MEMBER
+        ),
+    )
 
 
-def process_tpi(pdb):
+class TypeInternPool:
     """
-    Processes Type Information into Rekall-like representation
+    Pool of "$STRUCTS" entries shared by profiles generated in one run.
+
+    Structures with the same layout (see structure_key) are converted once,
+    and all profiles generated with the pool refer to the same entry. The
+    entries must not be modified.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def intern(self, struct, convert):
+        key = structure_key(struct)
+        if key is None:
+            return convert(struct)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        entry = convert(struct)
+        with self._lock:
+            return self._entries.setdefault(key, entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def select_structures(tpi_stream, structs):
+    """
+    Returns name -> type of structures named in `structs` and all structures
+    they refer to, directly or not. Other types are not decoded at all.
+    Names without a definition in the PDB are skipped.
+    """
+    selected = {}
+    pending = [tpi_stream.find_type(name) for name in structs]
+    pending = [struct for struct in reversed(pending) if struct is not None]
+    while pending:
+        struct = pending.pop()
+        if struct.name in selected:
+            continue
+        selected[struct.name] = struct
+        if not hasattr(struct.fieldlist, "substructs"):
+            continue
+        for member in struct.fieldlist.substructs:
+            if leaf_code(member) != LF_MEMBER:
+                continue
+            target = member_structure(member.index)
+            if target is not None and target.name not in selected:
+                pending.append(target)
+    return selected
+
+
+def embedded_structure(member_type):
+    """
+    Returns the structure or union stored in a member of `member_type` type
+    (directly, as array elements or with modifiers), None if there is none
+    """
+    while hasattr(member_type, "leaf_type"):
+        code = leaf_code(member_type)
+        if code in STRUCTURE_LEAF_TYPES:
+            return member_type
+        if code == LF_ARRAY:
+            member_type = member_type.element_type
+        elif code == LF_MODIFIER:
+            member_type = member_type.modified_type
+        else:
+            return None
+    return None
+
+
+UNNAMED_RE = re.compile(r"^__unnamed_[0-9a-f]+$")
+
+
+def _canonical(value):
+    # JSON-serializable form of structure keys. Names of unnamed types
+    # contain their type index, which changes between builds
+    if isinstance(value, tuple):
+        return [_canonical(item) for item in value]
+    if isinstance(value, str):
+        return UNNAMED_RE.sub("__unnamed", str(value))
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def layout_hashes(types):
+    """
+    Computes layout hashes of structures and unions in `types` (name -> type).
+
+    The hash covers the name and size of a structure and the name, offset
+    and type of each member. Layouts of structures stored in members (not
+    behind pointers) are covered recursively. Unnamed structures are only
+    hashed as parts of the structures they're stored in.
     """
+    memo = {}
+
+    def layout_hash(struct):
+        try:
+            return memo[id(struct)]
+        except KeyError:
+            pass
+        key = structure_key(struct)
+        if key is None:
+            # Not defined in this PDB
+            data = (struct.leaf_type, getattr(struct, "name", None))
+        else:
+            embedded = (
+                embedded_structure(member.index)
+                for member in struct.fieldlist.substructs
+                if leaf_code(member) == LF_MEMBER
+            )
+            data = (
+                key,
+                tuple(None if e is None else layout_hash(e) for e in embedded),
+            )
+        serialized = json.dumps(_canonical(data), separators=(",", ":"))
+        digest = hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+        memo[id(struct)] = digest
+        return digest
+
     return {
-        "$STRUCTS": {
-            type_info.name: process_structure(type_info)
+        name: layout_hash(struct)
+        for name, struct in types.items()
+        if structure_key(struct) is not None and not UNNAMED_RE.match(name)
+    }
+
+
+def diff_layout_hashes(old, new):
+    """
+    Compares two name -> layout hash mappings. Returns names of structures
+    that were added, removed and changed.
+    """
+    return {
+        "added": sorted(name for name in new if name not in old),
+        "removed": sorted(name for name in old if name not in new),
+        "changed": sorted(
+            name for name in old if name in new and old[name] != new[name]
+        ),
+    }
+
+
+def iter_tpi(pdb, structs=None, intern_pool=None, with_layout_hashes=False):
+    """
+    Yields (section name, entries) pairs of Type Information, where entries
+    of "$STRUCTS" are (name, structure) pairs converted on the fly. See
+    process_tpi for the meaning of arguments.
+    """
+    convert = TypeConverter().structure
+    if intern_pool is not None:
+        convert_structure = convert
+
+        def convert(struct):
+            return intern_pool.intern(struct, convert_structure)
+
+    if structs is not None:
+        types = select_structures(pdb.STREAM_TPI, structs)
+    else:
+        types = {
+            type_info.name: type_info
             for type_info in pdb.STREAM_TPI.types.values()
             if hasattr(type_info, "name")
         }
+    yield "$STRUCTS", ((name, convert(struct)) for name, struct in types.items())
+    if with_layout_hashes:
+        yield "$LAYOUT_HASHES", layout_hashes(types)
+
+
+def process_tpi(pdb, structs=None, intern_pool=None, with_layout_hashes=False):
+    """
+    Processes Type Information into Rekall-like representation. If `structs`
+    is given, only these structures and structures they refer to are
+    processed. Structures already in `intern_pool` (a TypeInternPool) are
+    taken from there instead of being converted again. With
+    `with_layout_hashes`, layout hashes of structures are added as
+    "$LAYOUT_HASHES".
+    """
+    return {
+        section: dict(entries)
+        for section, entries in iter_tpi(pdb, structs, intern_pool, with_layout_hashes)
     }
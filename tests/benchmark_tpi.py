@@ -0,0 +1,190 @@
+"""
+Measures how long it takes to decode and post-process TPI streams.
+
+Post-processing is timed both with tpi.process_types() and with the
+multi-pass post-processing it replaced (legacy_process_types() below), each
+run on a fresh decode of the same stream.
+
+Usage: python tests/benchmark_tpi.py [PDB files...]
+(all PDB files fetched to tests/pdbs by default)
+"""
+
+import pathlib
+import sys
+import time
+
+from construct import ListContainer
+
+from drakpdb import pdbparse
+from drakpdb.pdbparse import tpi
+
+package_dir = pathlib.Path(__file__).parent.absolute()
+pdbs_dir = package_dir / "pdbs"
+
+
+def legacy_resolve_typerefs(leaf, types, ti_min, refs):
+    for attr in refs.get(leaf.leaf_type, []):
+        ref = getattr(leaf, attr)
+        if isinstance(ref, list):
+            newrefs = []
+            for r in ref:
+                if r < ti_min:
+                    newrefs.append(tpi.base_type_name(r))
+                else:
+                    newrefs.append(types[r])
+            setattr(leaf, attr, ListContainer(newrefs))
+        elif ref < ti_min:
+            setattr(leaf, attr, tpi.base_type_name(ref))
+        elif ref in types:
+            setattr(leaf, attr, types[ref])
+    return leaf
+
+
+def legacy_merge_fwdrefs(leaf, types, fwdref_map, refs):
+    for attr in refs.get(leaf.leaf_type, []):
+        ref = getattr(leaf, attr)
+        if isinstance(ref, list):
+            newrefs = []
+            for r in ref:
+                try:
+                    newrefs.append(types[fwdref_map[r.tpi_idx]])
+                except (KeyError, AttributeError):
+                    newrefs.append(r)
+            setattr(leaf, attr, ListContainer(newrefs))
+        elif not isinstance(ref, str):
+            try:
+                setattr(leaf, attr, types[fwdref_map[ref.tpi_idx]])
+            except (KeyError, AttributeError):
+                pass
+    return leaf
+
+
+def legacy_process_types(types, ti_min):
+    """
+    Post-processes decoded types the way parse_stream() did before
+    process_types(): one pass over all types per step
+    """
+    # 1. Index the types
+    types = dict(zip(range(ti_min, ti_min + len(types)), types))
+    for idx, t in types.items():
+        t.tpi_idx = idx
+
+    # 2. Flatten type_info and type_data (types from the fast decoders
+    # are flat already)
+    for t in types.values():
+        if isinstance(t, tpi.TypeRecord):
+            continue
+        tpi.merge_subcon(t, "type_data")
+        tpi.merge_subcon(t, "type_info")
+        if t.leaf_type == "LF_FIELDLIST":
+            for s in t.substructs:
+                tpi.merge_subcon(s, "type_info")
+
+    # 3. Fix up value and name structures
+    for t in types.values():
+        if isinstance(t, tpi.TypeRecord):
+            continue
+        if t.leaf_type == "LF_FIELDLIST":
+            for s in t.substructs:
+                tpi.fix_value(s)
+        else:
+            tpi.fix_value(t)
+
+    # 4. Resolve type references
+    for t in types.values():
+        if t.leaf_type == "LF_FIELDLIST":
+            t.substructs = ListContainer(
+                [
+                    legacy_resolve_typerefs(s, types, ti_min, tpi.type_refs_fieldlist)
+                    for s in t.substructs
+                ]
+            )
+        else:
+            legacy_resolve_typerefs(t, types, ti_min, tpi.type_refs)
+
+    # 5. Standardize v2 leaf names to v7 convention
+    for t in types.values():
+        tpi.rename_2_7(t)
+        if t.leaf_type == "LF_FIELDLIST":
+            for s in t.substructs:
+                tpi.rename_2_7(s)
+
+    # 6. Eliminate forward refs
+    fwdrefs = {}
+    for idx, t in types.items():
+        if hasattr(t, "prop") and t.prop.fwdref:
+            fwdrefs[t.name] = idx
+    fwdref_map = {}
+    for t in types.values():
+        if hasattr(t, "name") and hasattr(t, "prop") and not t.prop.fwdref:
+            if t.name in fwdrefs:
+                fwdref_map[fwdrefs[t.name]] = t.tpi_idx
+    for t in types.values():
+        if t.leaf_type == "LF_FIELDLIST":
+            t.substructs = ListContainer(
+                [
+                    legacy_merge_fwdrefs(s, types, fwdref_map, tpi.type_refs_fieldlist)
+                    for s in t.substructs
+                ]
+            )
+        else:
+            legacy_merge_fwdrefs(t, types, fwdref_map, tpi.type_refs)
+    for idx in fwdref_map:
+        del types[idx]
+
+    # 7. Name unnamed types
+    for t in types.values():
+        if getattr(t, "name", None) in [
+            "__unnamed",
+            "<unnamed-tag>",
+            "<anonymous-tag>",
+        ]:
+            t.name = "__unnamed_%x" % t.tpi_idx
+    return types
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark(pdb_path, repeat=3):
+    pdb = pdbparse.parse(str(pdb_path), fast_load=True)
+    stream_file = pdb.streams[pdbparse.PDB_STREAM_TPI].stream_file
+    header = tpi.Header.parse_stream(stream_file)
+    data = bytes(stream_file.read())
+    count = header.ti_max - header.ti_min
+
+    decode_times = []
+    process_times = []
+    legacy_times = []
+    for _ in range(repeat):
+        types, elapsed = timed(tpi.decode_types, data, count)
+        decode_times.append(elapsed)
+        _, elapsed = timed(tpi.process_types, types, header.ti_min)
+        process_times.append(elapsed)
+        types = tpi.decode_types(data, count)
+        _, elapsed = timed(legacy_process_types, types, header.ti_min)
+        legacy_times.append(elapsed)
+    process_time = min(process_times)
+    legacy_time = min(legacy_times)
+    print(
+        "{:<40} {:>8} types  decode {:.3f}s  "
+        "post-process {:.3f}s (multi-pass {:.3f}s, {:.2f}x)".format(
+            pdb_path.name,
+            count,
+            min(decode_times),
+            process_time,
+            legacy_time,
+            legacy_time / process_time if process_time else 0,
+        )
+    )
+
+
+if __name__ == "__main__":
+    paths = [pathlib.Path(path) for path in sys.argv[1:]] or sorted(
+        pdbs_dir.glob("*.pdb")
+    )
+    for path in paths:
+        benchmark(path)
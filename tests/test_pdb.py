@@ -1,4 +1,37 @@
-from drakpdb.drakpdb import make_pdb_profile
+import importlib.metadata
+import io
+import json
+import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from construct import Container
+
+from drakpdb import (
+    TypeInternPool,
+    diff_pdb_layouts,
+    iter_pdb_profile,
+    pdb_layout_hashes,
+    pdbparse,
+    profile_cache,
+    update_index,
+    write_profile,
+    write_profile_file,
+)
+from drakpdb.drakpdb import (
+    Demangler,
+    demangle_names,
+    make_pdb_profile,
+    make_symstore_hash,
+)
+from drakpdb.pdbparse import gdata, omap, symtable, tpi, undname
+from drakpdb.pdbparse.hashing import hash_string_v1
+from drakpdb.pdbparse.omap import Omap
+from drakpdb.pdbparse.symtable import SymbolTable
+from drakpdb.profile_cache import ProfileCache
+from drakpdb.type_info import LF_MEMBER, TypeConverter, leaf_code, process_member_type
 
 
 def test_pdb_profile(pdb_file):
@@ -18,3 +51,580 @@ def test_kernel_types(nt_kernel_pdb_file):
     assert "_HANDLE_TABLE_ENTRY" in structs
     # Size of structure is more than 0
     assert structs["_HANDLE_TABLE_ENTRY"][0] > 0
+
+
+def test_mmap_streams(pdb_file):
+    mapped = pdbparse.parse(pdb_file, fast_load=True)
+    unmapped = pdbparse.parse(pdb_file, fast_load=True, use_mmap=False)
+    assert mapped.msf.buf is not None
+    assert unmapped.msf.buf is None
+    assert len(mapped.streams) == len(unmapped.streams)
+    for mapped_stream, unmapped_stream in zip(mapped.streams, unmapped.streams):
+        assert bytes(mapped_stream.data) == bytes(unmapped_stream.data)
+        mapped_stream.stream_file.seek(0)
+        unmapped_stream.stream_file.seek(0)
+        head = unmapped_stream.stream_file.read(13)
+        assert mapped_stream.stream_file.read(13) == head
+
+
+def test_pdb_profile_from_bytes(pdb_file):
+    data = pdb_file.read_bytes()
+    assert make_pdb_profile(pdb_file, data=memoryview(data)) == make_pdb_profile(
+        pdb_file
+    )
+
+
+def test_page_cache_eviction():
+    cache = pdbparse.PageCache(max_size=8)
+    cache.put(1, b"aaaa")
+    cache.put(2, b"bbbb")
+    assert cache.get(1) == b"aaaa"
+    # Page 2 is the least recently used one
+    cache.put(3, b"cccc")
+    assert cache.get(2) is None
+    assert cache.get(1) == b"aaaa"
+    assert cache.get(3) == b"cccc"
+    assert cache.size == 8
+
+
+def test_lazy_streams(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    assert pdb.STREAM_GSYM.globals
+    # Symbols were read without parsing the types stream
+    assert not pdb.streams[pdbparse.PDB_STREAM_TPI].loaded
+    assert pdb.STREAM_TPI.types
+    assert pdb.streams[pdbparse.PDB_STREAM_TPI].loaded
+
+
+def test_probe(pdb_file):
+    pdb_probe = pdbparse.probe(pdb_file)
+    pdb = pdbparse.parse(pdb_file)
+    assert make_symstore_hash(pdb_probe) == make_symstore_hash(pdb.STREAM_PDB)
+    assert pdb_probe.TimeDateStamp == pdb.STREAM_PDB.TimeDateStamp
+    assert pdb_probe.Machine == str(pdb.STREAM_DBI.machine)
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_probe_broken_file(pdb_file, tmp_path):
+    with open(pdb_file, "rb") as f:
+        header = f.read(4096)
+    garbage = tmp_path / "garbage.pdb"
+    garbage.write_bytes(b"not a pdb file" * 100)
+    truncated = tmp_path / "truncated.pdb"
+    truncated.write_bytes(header[:100])
+    open_fds = len(os.listdir("/proc/self/fd"))
+    # Tracebacks keep the frames alive, so files left open aren't closed
+    # by the garbage collector either
+    errors = []
+    for path in (garbage, truncated):
+        with pytest.raises(Exception) as error:
+            pdbparse.probe(str(path))
+        errors.append(error)
+    assert len(os.listdir("/proc/self/fd")) == open_fds
+
+
+def test_index(pdb_file, tmp_path):
+    shutil.copy(pdb_file, tmp_path / "test.pdb")
+    index, probed = update_index(str(tmp_path))
+    assert probed == 1
+    guid_age = make_symstore_hash(pdbparse.probe(pdb_file))
+    assert index["pdbs"] == {guid_age: "test.pdb"}
+    # Unchanged files are not probed again
+    index, probed = update_index(str(tmp_path))
+    assert probed == 0
+    assert index["pdbs"] == {guid_age: "test.pdb"}
+    assert sorted(os.listdir(str(tmp_path))) == ["drakpdb_index.json", "test.pdb"]
+
+
+def test_concurrent_stream_loading(pdb_file):
+    names = ["STREAM_TPI", "STREAM_GSYM", "STREAM_DBI", "STREAM_SECT_HDR"]
+
+    def summary(stream):
+        if hasattr(stream, "types"):
+            return len(stream.types)
+        if hasattr(stream, "globals"):
+            return [(g.name, g.offset) for g in stream.globals]
+        if hasattr(stream, "files"):
+            return stream.files
+        return [s.Name for s in stream.sections]
+
+    serial = pdbparse.parse(pdb_file, use_mmap=False)
+    expected = [summary(getattr(serial, name)) for name in names]
+
+    pdb = pdbparse.parse(pdb_file, use_mmap=False)
+    with ThreadPoolExecutor(len(names)) as executor:
+        streams = list(executor.map(lambda name: getattr(pdb, name), names))
+    assert [summary(stream) for stream in streams] == expected
+
+
+def _type_summary(value, top=True):
+    if isinstance(value, tpi.TypeRecord):
+        value = {k: getattr(value, k) for k in value.__slots__ if hasattr(value, k)}
+    # References to other types are compared by their index only
+    if isinstance(value, dict):
+        if not top and "tpi_idx" in value:
+            return value["tpi_idx"]
+        # Containers of unparsed types have an empty type_info
+        return {
+            k: _type_summary(v, False)
+            for k, v in value.items()
+            if not k.startswith("_") and not (k == "type_info" and v is None)
+        }
+    if isinstance(value, list):
+        return [_type_summary(v, False) for v in value]
+    return value
+
+
+def test_fast_type_decoder(pdb_file):
+    pdb = pdbparse.parse(pdb_file, fast_load=True)
+    stream_file = pdb.streams[pdbparse.PDB_STREAM_TPI].stream_file
+    types = {}
+    for fast in (False, True):
+        stream_file.seek(0)
+        types[fast] = tpi.parse_stream(stream_file, fast=fast).types
+    assert types[True].keys() == types[False].keys()
+    for idx, t in types[False].items():
+        assert _type_summary(types[True][idx]) == _type_summary(t)
+
+
+def test_truncated_type_records():
+    # The bytes after the record belong to the next one, decoders must not
+    # read fixed fields from them
+    data = bytes(64)
+    lf = tpi.leaf_type_name(0)
+    for code, decoder in tpi._type_decoders.items():
+        if code == tpi.LEAF_TYPE_CODES["LF_FIELDLIST"]:
+            continue
+        with pytest.raises(tpi._ParseError):
+            decoder(data, 0, 1, 1, lf)
+    for decoder in tpi._substruct_decoders.values():
+        with pytest.raises(tpi._ParseError):
+            decoder(data, 0, 1, lf)
+
+    # A truncated member ends the field list
+    member = struct.pack("<HHIH", tpi.LEAF_TYPE_CODES["LF_MEMBER"], 3, 0x74, 8)
+    record = struct.pack("<H", tpi.LEAF_TYPE_CODES["LF_FIELDLIST"]) + member + b"a\0"
+    data = record + member + b"b\0"
+    fieldlist = tpi.decode_type(data, 0, len(record) + 4)
+    assert [sub.name for sub in fieldlist.substructs] == ["a"]
+
+
+def test_lazy_types(pdb_file):
+    pdb = pdbparse.parse(pdb_file, fast_load=True)
+    stream_file = pdb.streams[pdbparse.PDB_STREAM_TPI].stream_file
+    eager = tpi.parse_stream(stream_file).types
+    stream_file.seek(0)
+    lazy = tpi.parse_stream(stream_file, lazy=True).types
+    idx = max(eager)
+    assert _type_summary(lazy[idx]) == _type_summary(eager[idx])
+    # Only the requested type and its references were decoded
+    assert len(lazy._types) < len(eager)
+    assert list(lazy) == list(eager)
+    for idx, t in eager.items():
+        assert _type_summary(lazy[idx]) == _type_summary(t)
+
+
+def test_find_type(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    types = pdb.STREAM_TPI.types
+    name, idx = next(iter(types.definitions.items()))
+    pdb = pdbparse.parse(pdb_file)
+    found = pdb.STREAM_TPI.find_type(name)
+    assert found.tpi_idx == idx
+    assert not found.prop.fwdref
+    assert pdb.STREAM_TPI.find_type("does not exist") is None
+
+
+def test_hash_string_v1():
+    # Buckets of these types in the TPI hash stream of an MSVC-built PDB
+    assert hash_string_v1("_GUID") % 0x3FFFF == 15181
+    assert hash_string_v1(b"_RTL_CRITICAL_SECTION") % 0x3FFFF == 192069
+    assert hash_string_v1("std::exception") % 0x3FFFF == 138787
+
+
+def referenced_names(structs):
+    """Returns names of types that members of `structs` refer to"""
+    names = set()
+    pending = [
+        descriptor
+        for _, fields in structs.values()
+        for _, descriptor in fields.values()
+    ]
+    while pending:
+        descriptor = pending.pop()
+        if isinstance(descriptor, str):
+            names.add(descriptor)
+            continue
+        name, args = descriptor
+        names.add(name)
+        if "target" in args:
+            pending.append(args["target"])
+    return names
+
+
+def test_selected_structs(pdb_file):
+    structs = make_pdb_profile(pdb_file)["$STRUCTS"]
+    name = next(name for name, layout in structs.items() if layout[1])
+    selected = make_pdb_profile(pdb_file, structs=[name])["$STRUCTS"]
+    assert name in selected
+    assert len(selected) < len(structs)
+    for name, layout in selected.items():
+        assert structs[name] == layout
+
+    # Structures referenced by members of selected ones are selected too
+    names = [
+        name
+        for name, layout in structs.items()
+        if referenced_names({name: layout}) & structs.keys() - {name}
+    ]
+    selected = make_pdb_profile(pdb_file, structs=names)["$STRUCTS"]
+    for name in referenced_names(selected):
+        assert name not in structs or name in selected
+
+
+def test_type_records(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    name = next(iter(pdb.STREAM_TPI.types.definitions))
+    struct = pdb.STREAM_TPI.find_type(name)
+    assert isinstance(struct, tpi.TypeRecord)
+    assert not hasattr(struct, "__dict__")
+    assert not hasattr(struct, "_pad")
+    assert struct.name == name
+    for member in getattr(struct.fieldlist, "substructs", []):
+        assert isinstance(member, tpi.TypeRecord)
+
+
+def test_type_code_tables():
+    assert tpi.leaf_type_name(tpi.LEAF_TYPE_CODES["LF_STRUCTURE"]) == "LF_STRUCTURE"
+    assert tpi.base_type_name(0x0074) == "T_INT4"
+    assert int(tpi.base_type_name(0x0074)) == 0x0074
+    # Unknown codes are kept as integers
+    assert tpi.base_type_name(0x7FFF) == 0x7FFF
+
+    # v2 leaf types are renamed to v7 ones, code included
+    member = Container(leaf_type=tpi.leaf_type_name(0x1405))
+    assert member.leaf_type == "LF_MEMBER_ST"
+    tpi.rename_2_7(member)
+    assert member.leaf_type == "LF_MEMBER"
+    assert leaf_code(member) == LF_MEMBER
+
+
+def test_type_codes(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    for t in pdb.STREAM_TPI.types.values():
+        # Every type carries the code of its leaf type, type_info compares
+        # leaf types by code
+        assert tpi.leaf_type_name(int(t.leaf_type)) == t.leaf_type
+        for member in getattr(t, "substructs", []):
+            assert tpi.leaf_type_name(int(member.leaf_type)) == member.leaf_type
+
+
+def test_intern_pool(pdb_file):
+    pool = TypeInternPool()
+    first = make_pdb_profile(pdb_file, intern_pool=pool)["$STRUCTS"]
+    second = make_pdb_profile(pdb_file, intern_pool=pool)["$STRUCTS"]
+    assert first == make_pdb_profile(pdb_file)["$STRUCTS"]
+    assert pool.hits > 0
+    for name, layout in first.items():
+        if layout[1]:
+            assert second[name] is layout
+
+
+def test_layout_hashes(pdb_file):
+    hashes = pdb_layout_hashes(pdb_file)
+    assert hashes
+    assert (
+        hashes == make_pdb_profile(pdb_file, with_layout_hashes=True)["$LAYOUT_HASHES"]
+    )
+    assert diff_pdb_layouts(pdb_file, hashes) == {
+        "added": [],
+        "removed": [],
+        "changed": [],
+    }
+    name = next(iter(hashes))
+    changed = dict(hashes, **{name: "0" * 32})
+    del changed[next(n for n in hashes if n != name)]
+    changes = diff_pdb_layouts(hashes, changed)
+    assert changes["changed"] == [name]
+    assert len(changes["removed"]) == 1
+
+
+def test_type_converter(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    converter = TypeConverter()
+    converted = {}
+    for type_info in pdb.STREAM_TPI.types.values():
+        if type_info.leaf_type in ["LF_ARRAY", "LF_ENUM", "LF_MODIFIER"]:
+            descriptor = converter.member_type(type_info)
+            assert descriptor == process_member_type(type_info)
+            assert converter.member_type(type_info) is descriptor
+            converted[type_info.leaf_type] = descriptor
+    assert converted["LF_ARRAY"][0] == "Array"
+    assert converted["LF_ENUM"][0] == "Enumeration"
+
+    # Long chains are converted without recursion
+    base_type = tpi.base_type_name(tpi.base_types["T_ULONG"])
+    pointer = tpi.leaf_type_name(tpi.LEAF_TYPE_CODES["LF_POINTER"])
+    chain = base_type
+    for tpi_idx in range(0x1000, 0x1000 + 5000):
+        chain = tpi.PointerType(0, pointer, chain, None, tpi_idx)
+    descriptor = TypeConverter().member_type(chain)
+    for _ in range(4999):
+        assert descriptor[0] == "Pointer"
+        descriptor = [descriptor[1]["target"], descriptor[1].get("target_args")]
+    assert descriptor == ["Pointer", {"target": "unsigned long"}]
+
+
+def test_write_profile(pdb_file, tmp_path):
+    profile = make_pdb_profile(pdb_file)
+    expected = json.dumps(profile, indent=4).encode()
+    out = io.BytesIO()
+    assert write_profile(iter_pdb_profile(pdb_file), out) == len(expected)
+    assert out.getvalue() == expected
+
+    path = str(tmp_path / "profile.json")
+    write_profile_file(iter_pdb_profile(pdb_file), path)
+    with open(path, "rb") as f:
+        assert f.read() == expected
+    assert os.listdir(str(tmp_path)) == ["profile.json"]
+
+    # A failed write leaves the previous profile and no temporary files
+    def broken_sections():
+        yield "$METADATA", {}
+        raise RuntimeError("broken")
+
+    with pytest.raises(RuntimeError):
+        write_profile_file(broken_sections(), path)
+    assert os.listdir(str(tmp_path)) == ["profile.json"]
+    with open(path, "rb") as f:
+        assert f.read() == expected
+
+    out = io.BytesIO()
+    write_profile(iter_pdb_profile(pdb_file), out, indent=None, backend="json")
+    assert out.getvalue() == json.dumps(profile, separators=(",", ":")).encode()
+
+    out = io.BytesIO()
+    write_profile([("$EMPTY", iter([])), ("$DICT", {})], out)
+    assert out.getvalue() == json.dumps({"$EMPTY": {}, "$DICT": {}}, indent=4).encode()
+
+
+def test_write_profile_orjson(pdb_file):
+    pytest.importorskip("orjson")
+    out = io.BytesIO()
+    write_profile(iter_pdb_profile(pdb_file), out, indent=None, backend="orjson")
+    assert json.loads(out.getvalue()) == make_pdb_profile(pdb_file)
+
+
+def test_profile_cache(pdb_file, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    profile = make_pdb_profile(pdb_file, cache_dir=cache_dir)
+    assert profile == make_pdb_profile(pdb_file)
+    assert len(os.listdir(cache_dir)) == 1
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("PDB parsed despite cached profile")
+
+    monkeypatch.setattr("drakpdb.drakpdb.iter_pdb_profile", no_parsing)
+    assert make_pdb_profile(pdb_file, cache_dir=cache_dir) == profile
+    with open(pdb_file, "rb") as f:
+        data = f.read()
+    assert make_pdb_profile(pdb_file, data=data, cache_dir=cache_dir) == profile
+    # Other options make another profile
+    with pytest.raises(AssertionError):
+        make_pdb_profile(pdb_file, full_demangle=True, cache_dir=cache_dir)
+
+
+def test_profile_cache_corrupt_entry(tmp_path):
+    cache = ProfileCache(str(tmp_path))
+    key = cache.key("guid_age")
+    profile = {"$METADATA": {"Name": "x"}}
+    cache.put(key, profile)
+    with open(cache._path(key), "r+b") as f:
+        f.truncate(10)
+    # A corrupt entry is a miss, and it's removed
+    assert cache.get(key) is None
+    assert os.listdir(str(tmp_path)) == []
+    cache.put(key, profile)
+    assert cache.get(key) == profile
+
+
+def test_profile_cache_source_version(tmp_path, monkeypatch):
+    cache = ProfileCache(str(tmp_path))
+    installed_key = cache.key("guid_age")
+
+    def not_installed(name):
+        raise importlib.metadata.PackageNotFoundError(name)
+
+    monkeypatch.setattr(importlib.metadata, "version", not_installed)
+    # Without package metadata, the version comes from the sources
+    assert profile_cache._drakpdb_version().startswith("source-")
+    assert cache.key("guid_age") == cache.key("guid_age") != installed_key
+
+
+def test_profile_cache_eviction(tmp_path):
+    profile = {"$METADATA": {"Name": "x" * 20}}
+    size = len(json.dumps(profile, separators=(",", ":")))
+    # Room for 3 profiles
+    cache = ProfileCache(str(tmp_path), max_size=size * 3 + size // 2)
+    keys = [cache.key("guid_age", n=n) for n in range(4)]
+    assert len(set(keys)) == 4
+    for n, key in enumerate(keys[:3]):
+        cache.put(key, profile)
+        os.utime(cache._path(key), ns=(n * 10**9, n * 10**9))
+    # Using a profile makes it the most recent one
+    assert cache.get(keys[0]) == profile
+    cache.put(keys[3], profile)
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        key + ".json" for key in (keys[0], keys[2], keys[3])
+    )
+    assert cache.get(keys[1]) is None
+
+
+def test_global_symbols(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    stream = pdb.STREAM_GSYM
+    expected = [
+        (s.length, s.leaf_type, s.symtype, s.offset, s.segment, s.name)
+        for s in gdata.parse(bytes(stream.data))
+        if "symtype" in s
+    ]
+    assert [tuple(g) for g in stream.globals] == expected
+    kinds = {type(s) for s in stream.symbols}
+    assert kinds == {gdata.PublicSymbol, gdata.DataSymbol, gdata.ProcRefSymbol}
+
+
+def test_truncated_global_symbols():
+    def record(leaf_type, body):
+        return struct.pack("<HH", len(body) + 2, leaf_type) + body
+
+    fields = struct.pack("<IIH", 2, 0x10, 1)
+    public = record(gdata.S_PUB32, fields + b"name\0")
+    # No room for the length of the name, and a name past the record
+    no_name = record(gdata.S_PUB32_ST, fields)
+    long_name = record(gdata.S_PUB32_ST, fields + b"\x10name")
+    for data in (no_name + public, long_name + public, public + no_name):
+        symbols = list(gdata.decode_symbols(data))
+        assert [(s.offset, s.name) for s in symbols] == [(0x10, "name")]
+
+
+def test_public_symbol_address_map(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    publics = list(pdb.STREAM_PSGSI.publics())
+    assert len(publics) == len(pdb.STREAM_PSGSI.addr_map)
+    assert publics == sorted(publics, key=lambda sym: (sym.segment, sym.offset))
+    assert sorted(publics) == sorted(pdb.STREAM_GSYM.globals)
+
+
+@pytest.fixture(params=["array", "numpy"])
+def array_backend(request, monkeypatch):
+    """Makes SymbolTable and Omap use plain arrays or numpy"""
+    if request.param == "numpy":
+        numpy = pytest.importorskip("numpy")
+    else:
+        numpy = None
+    monkeypatch.setattr(symtable, "numpy", numpy)
+    monkeypatch.setattr(omap, "numpy", numpy)
+    return numpy
+
+
+@pytest.mark.parametrize("presorted", [True, False])
+def test_symbol_table(pdb_file, array_backend, presorted):
+    pdb = pdbparse.parse(pdb_file)
+    sects = pdb.STREAM_SECT_HDR.sections
+    publics = list(pdb.STREAM_PSGSI.publics())
+    if not presorted:
+        publics.reverse()
+    symbols = SymbolTable(publics)
+    symbols.map(sects, base=0x10000)
+    assert len(symbols) == len(publics)
+    assert symbols.presorted == presorted
+
+    names_at = {}
+    expected_groups = {}
+    for sym in publics:
+        if not 0 < sym.segment <= len(sects):
+            continue
+        address = 0x10000 + sects[sym.segment - 1].VirtualAddress + sym.offset
+        names_at.setdefault(address, set()).add(sym.name)
+        expected_groups.setdefault(sym.name, []).append(address)
+    for address, names in names_at.items():
+        name, displacement = symbols.lookup(address)
+        assert name in names and displacement == 0
+        if address + 1 not in names_at:
+            assert symbols.lookup(address + 1)[1] == 1
+    assert symbols.lookup(0xFFFF) is None
+
+    assert list(symbols.groups()) == [
+        (name, sorted(addresses)) for name, addresses in expected_groups.items()
+    ]
+    functions = dict(symbols.groups(flag_mask=2, flag_value=2))
+    constants = dict(symbols.groups(flag_mask=2, flag_value=0))
+    assert functions.keys() | constants.keys() == expected_groups.keys()
+
+
+def test_omap_remap_many(array_backend):
+    entries = [(0x1000, 0x2000), (0x1100, 0), (0x1200, 0x5000), (0x1300, 0)]
+    omap_data = Omap(b"".join(struct.pack("<II", *entry) for entry in entries))
+    addresses = [0x1000, 0x1050, 0x1100, 0x1150, 0x1210, 0x12FF, 0x1300, 0x2000]
+    expected = []
+    for address in addresses:
+        try:
+            expected.append(omap_data.remap(address))
+        except IndexError:
+            expected.append(-1)
+    assert expected == [0x2000, 0x2050, 0, 0, 0x5010, 0x50FF, -1, -1]
+    if array_backend is None:
+        assert omap_data.remap_many(addresses) == expected
+    else:
+        remapped = omap_data.remap_many(array_backend.array(addresses))
+        assert remapped.tolist() == expected
+
+
+def test_find_symbol(pdb_file):
+    pdb = pdbparse.parse(pdb_file)
+    stream = pdb.STREAM_GSYM
+    assert stream.find_symbol("no_such_symbol") == []
+    # Lookups decode only the records in the hash bucket of the name
+    assert "symbols" not in stream.__dict__
+    for sym in stream.symbols:
+        found = stream.find_symbol(sym.name)
+        assert sym in found
+        assert all(other.name == sym.name for other in found)
+
+
+def test_demangle_names():
+    names = [
+        "_NtClose@4",
+        "?what@exception@std@@UEBAPEBDXZ",
+        "_KeNumberProcessors",
+        ".text",
+        "??_C@_05@ABCD@hello?$AA@",
+        "PsInitialSystemProcess",
+    ]
+    assert demangle_names(names) == [
+        "NtClose",
+        "what",
+        "KeNumberProcessors",
+        "text",
+        "str:hello",
+        "PsInitialSystemProcess",
+    ]
+    assert [Demangler().DemangleName(name) for name in names] == demangle_names(names)
+    full = demangle_names(names, full=True)
+    assert full[1] == "std::exception::what"
+    assert full[:1] + full[2:] == demangle_names(names[:1] + names[2:])
+
+
+def test_undname_many():
+    names = ["?what@exception@std@@UEBAPEBDXZ", b"??0exception@std@@QEAA@XZ", "x"]
+    flags = undname.UNDNAME_NAME_ONLY
+    assert undname.undname_many(names, flags) == [
+        "std::exception::what",
+        "std::exception::exception",
+        "x",
+    ]
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(undname.undname_many, [names] * 8, [flags] * 8))
+    assert all(result == results[0] for result in results)
+    with pytest.raises(TypeError):
+        undname.undname_many([1], flags)